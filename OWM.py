@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
-from ui_functions.mainWindow import *
 
 if __name__ == '__main__':
     import sys
+    import multiprocessing
+    # Not at the top: the analysis workers run this file again, they don't need the GUI
+    from ui_functions.mainWindow import *
+
+    # The ROM analysis starts worker processes, a frozen build has to handle them
+    multiprocessing.freeze_support()
 
     app = QtWidgets.QApplication(sys.argv)
     app.setWindowIcon(QtGui.QIcon("Files/App.ico"))
@@ -1,10 +1,24 @@
+import hashlib
+from array import array
 from PIL import Image
 from core_files.core import *
 from core_files.rom_api import *
+from core_files.range_cache import RangeCache
+from core_files.palette_codec import decode_palette, encode_palette, get_palette, gba_color_to_rgb, \
+    PALETTE_SIZE
 
 
 PAL_TBL_PTRS = []
 FREE_SPC = 0
+# Memory ceiling of the decoded frames, in pixels (they are 1 byte per pixel images)
+FRAME_CACHE_BYTES = 8 * 1024 * 1024
+# Decoded frames, see get_ow_frame. Every frame costs its pixels
+frame_cache = RangeCache(rom, FRAME_CACHE_BYTES)
+# Imported frames identical to the ones of another OW point to them,
+# toggled from the Actions menu (see set_frame_dedup)
+FRAME_DEDUP = False
+# Digests of the frames of the OWs, every entry costs 1
+frame_hashes = RangeCache(rom, 0x10000)
 
 global root
 root = Root()
@@ -27,52 +41,56 @@ def change_image_editor_info(ptrs_list):
     global PAL_TBL_PTRS
     PAL_TBL_PTRS = ptrs_list
 
-def update_free_space(size, start_addr=FREE_SPC):
+def update_free_space(size, start_addr=None):
     global FREE_SPC
+    if start_addr is None:
+        start_addr = FREE_SPC
     FREE_SPC = find_free_space(size, start_addr, 2)
 
-def write_two_pixels(index1, index2, addr):
-    # Index <= 0xF
-    index2 *= 16
-    write_byte(addr, index1 + index2)
-
 def import_frame(im, addr, ow_type, row_grid=0, column_grid=0):
-    if ow_type == 1:
-        row = 4
-        col = 2
-    elif ow_type == 2:
-        row = 4
-        col = 4
-    elif ow_type == 3:
-        row = 2
-        col = 2
-    elif ow_type == 4:
-        row = 8
-        col = 8
-    elif ow_type == 5:
-        row = 8
-        col = 16
-    else:
-        row = 6
-        col = 6
+    # im is indexed, (column_grid, row_grid) is the top left corner of the frame
+    width, height = get_frame_dimensions(ow_type)
+    frame = im.crop((column_grid, row_grid, column_grid + width, row_grid + height))
+
+    rom.write_slice(addr, linear_to_tiles(pack_pixels(frame.tobytes()), width, height))
 
-    for r in range(0, row):
-        # Number of horizontal 8X8 squares
 
-        for c in range(0, col):
-            # Number of vertical 8x8 squares
+def get_frames_hash(frames):
+    ow_type = frames.get_type()
+    frames_num = frames.get_num()
+    size = frames_num * get_frame_size(ow_type)
 
-            for i in range(0, 8):
-                # Number of rows in the square
+    key = (frames.frames_addr, ow_type, frames_num)
+    digest = frame_hashes.get(key)
+    if digest is None:
+        digest = hashlib.blake2b(rom.read_slice(frames.frames_addr, size), digest_size=16).digest()
+        frame_hashes.put(key, digest, [(frames.frames_addr, frames.frames_addr + size)], 1)
+    return digest
 
-                for j in range(0, 7, 2):
-                    # Number of columns in the square
+def set_frame_dedup(enabled):
+    global FRAME_DEDUP
+    FRAME_DEDUP = bool(enabled)
 
-                    byte1 = im.getpixel(((c * 8) + j + column_grid, (r * 8) + i + row_grid))
-                    byte2 = im.getpixel(((c * 8) + j + 1 + column_grid, (r * 8) + i + row_grid))
+def share_frames(ow):
+    # Points the OW to the frames of another OW if they are identical
+    frames = ow.frames
+    ow_type = frames.get_type()
+    frames_num = frames.get_num()
+    size = frames_num * get_frame_size(ow_type)
+    digest = get_frames_hash(frames)
 
-                    write_two_pixels(byte1, byte2, addr)
-                    addr += 1
+    for table in root.tables_list:
+        for other in table.ow_data_ptrs:
+            other_addr = other.frames.frames_addr
+            if other_addr == frames.frames_addr or other.frames.get_type() != ow_type \
+                    or other.frames.get_num() != frames_num or get_frames_hash(other.frames) != digest:
+                continue
+            if rom.read_slice(other_addr, size) != rom.read_slice(frames.frames_addr, size):
+                continue
+            print("Image: Sharing the frames at "+HEX(other_addr))
+            frames.share(other_addr)
+            return 1
+    return 0
 
 
 # === ============== ===
@@ -101,12 +119,8 @@ def write_palette_id(addr, palette_id):
     write_bytes(addr + 4, [byte2, byte1])
 
 def is_palette_table_end(addr):
-    rom.seek(addr)
-
-    # test = rom.read_byte() + rom.read_byte() + rom.read_byte() + rom.read_byte()
-    test = sum(read_bytes(addr, 4))
-    if test == 0:
-        if read_bytes(addr+4, 2) == [0xff, 0x11]:
+    if read_word(addr) == 0:
+        if rom.read_slice(addr + 4, 2) == b'\xff\x11':
             return 1
         else:
             return 0
@@ -122,12 +136,7 @@ def is_palette_ptr(addr):
         if is_ptr(addr) != 1:
             palette_ptr = 0
 
-        rom.seek(addr + 5)
-        if rom.read_byte() != 0x11:
-            palette_ptr = 0
-        if rom.read_byte() != 0x0:
-            palette_ptr = 0
-        if rom.read_byte() != 0x0:
+        if rom.read_slice(addr + 5, 3) != b'\x11\x00\x00':
             palette_ptr = 0
     except IndexError:
         return 0
@@ -138,29 +147,34 @@ def write_palette_table_end(addr):
 
 def replace_palette_id_in_ows(old_palette_id, new_palette_id):
     # Replaces the old palette with the new palette number in all the OWs
+    for ow_data_addr in palette_usage.ow_data_addrs_using(root.tables_list, old_palette_id):
+        write_ow_palette_id(ow_data_addr, new_palette_id)
 
-    for ow_table in root.tables_list:
-        # Browse through all the Tables
-
-        for ow in ow_table.ow_data_ptrs:
-            # Browse through all the OWs
-
-            if get_ow_palette_id(ow.ow_data_addr) == old_palette_id:
-                # The OW has the specific Palette ID
+def remove_palette(palette_addr):
+    remove_palettes([palette_addr])
 
-                write_ow_palette_id(ow.ow_data_addr, new_palette_id)
+def remove_palettes(palette_addrs):
+    # Removes the palettes and compacts the table with a single write
+    palette_addrs = sorted(set(palette_addrs))
+    if not palette_addrs:
+        return
 
-def remove_palette(palette_addr):
     # Remove the color data
-    fill_with_data(ptr_to_addr(palette_addr), 32, 0xFF)
-
-    # Move all the other palettes left (the palette to be removed will be just be replaced
-    working_addr = palette_addr + 8
-    while not is_palette_table_end(working_addr):
-        # Move the palette data left
-        move_data(working_addr, working_addr - 8, 8, 0x0)
-        working_addr += 8
-    move_data(working_addr, working_addr - 8, 8, 0x0)
+    for palette_addr in palette_addrs:
+        fill_with_data(ptr_to_addr(palette_addr), 32, 0xFF)
+
+    first = palette_addrs[0]
+    table_end = first
+    while not is_palette_table_end(table_end):
+        table_end += 8
+
+    # The other palettes are moved left, the table end follows them
+    # and the freed slots are cleared
+    entries = rom.read_slice(first, table_end + 8 - first)
+    removed = set(palette_addrs)
+    kept = [entries[i:i + 8] for i in range(0, table_end - first, 8) if first + i not in removed]
+    cleared = (table_end - first) // 8 - len(kept)
+    rom.write_slice(first, b"".join(kept) + entries[-8:] + bytes(cleared * 8))
 
 def get_background_color(image):
     im_palette = image.getpalette()
@@ -176,25 +190,11 @@ def get_background_color(image):
     return color
 
 def rgb_to_gba(red, green, blue):
-    gba_color = (((red >> 3) & 31) | (((green >> 3) & 31) << 5) | (((blue >> 3) & 31) << 10))
-
-    byte1 = gba_color % 256
-    byte2 = int(gba_color / 256)
-
-    return byte1, byte2
+    return tuple(encode_palette([red, green, blue], 1))
 
 def gba_to_rgb(gba_color):
     # Switch the two bytes (gba logic :p)
-    byte1 = gba_color % 256
-    byte2 = int(gba_color / 256)
-    gba_color = (byte1 * 256) + byte2
-
-    red = (gba_color & 31) << 3
-    green = ((gba_color >> 5) & 31) << 3
-    blue = ((gba_color >> 10) & 31) << 3
-
-    rgb_color = (red, green, blue)
-    return rgb_color
+    return gba_color_to_rgb(((gba_color % 256) << 8) | (gba_color >> 8))
 
 def swap_colors(id1, id2, palette, image):
     t1 = palette[id1 * 3]
@@ -235,37 +235,57 @@ def make_bg_color_first(image):
 def write_color(color, addr):
     write_bytes(addr, color)
 
-def byte_to_pixels(byte):
-    pixel1 = int(byte / 16)
-    pixel2 = byte % 16
-
-    return pixel2, pixel1
+# 4bpp pixels: the low nibble is the left pixel
+LOW_PIXELS = bytes(i % 16 for i in range(256))
+HIGH_PIXELS = bytes(i // 16 for i in range(256))
+HIGH_NIBBLES = bytes((i % 16) * 16 for i in range(256))
+
+def tiles_to_linear(data, width, height):
+    # Reorders 8x8 4bpp tiles to image rows, a tile row is a 4 byte word
+    column = width // 8
+    tiles = array("I")
+    tiles.frombytes(data)
+    rows = array("I", bytes(len(data)))
+    for r in range(0, height // 8):
+        tile_row = r * column * 8
+        for i in range(0, 8):
+            rows[tile_row + i * column:tile_row + (i + 1) * column] = \
+                tiles[tile_row + i:tile_row + column * 8:8]
+    return rows.tobytes()
+
+def linear_to_tiles(data, width, height):
+    column = width // 8
+    rows = array("I")
+    rows.frombytes(data)
+    tiles = array("I", bytes(len(data)))
+    for r in range(0, height // 8):
+        tile_row = r * column * 8
+        for i in range(0, 8):
+            tiles[tile_row + i:tile_row + column * 8:8] = \
+                rows[tile_row + i * column:tile_row + (i + 1) * column]
+    return tiles.tobytes()
+
+def pack_pixels(pixels):
+    # Two pixels (palette index <= 0xF) per byte
+    pixels = bytes(pixels)
+    low = int.from_bytes(pixels[0::2].translate(LOW_PIXELS), "little")
+    high = int.from_bytes(pixels[1::2].translate(HIGH_NIBBLES), "little")
+    return (low | high).to_bytes(len(pixels) // 2, "little")
+
+def unpack_pixels(data):
+    # One byte per pixel
+    pixels = bytearray(len(data) * 2)
+    pixels[0::2] = data.translate(LOW_PIXELS)
+    pixels[1::2] = data.translate(HIGH_PIXELS)
+    return pixels
 
 def create_image_from_addr(im_addr, width, height):
-    row = int(height / 8)
-    column = int(width / 8)
+    return create_image_from_data(rom.read_slice(im_addr, width * height // 2), width, height)
 
+def create_image_from_data(data, width, height):
+    # Doesn't touch the ROM, so it can run in other threads
     obj = Image.new("P", (width, height))
-
-    global rom
-    rom.seek(im_addr)
-    for r in range(0, row):
-        # Number of horizontal 8X8 squares
-
-        for c in range(0, column):
-            # Number of vertical 8x8 squares
-
-            for i in range(0, 8):
-                # Number of rows in the square
-
-                for j in range(0, 7, 2):
-                    # Number of columns in the square
-                    byte = rom.read_byte()
-
-                    pixel1, pixel2 = byte_to_pixels(byte)
-                    obj.putpixel(((c * 8) + j, (r * 8) + i), pixel1)
-                    obj.putpixel(((c * 8) + j + 1, (r * 8) + i), pixel2)
-
+    obj.frombytes(bytes(unpack_pixels(tiles_to_linear(data, width, height))))
     return obj
 
 def make_image_from_rom(working_ow, working_table):
@@ -286,44 +306,144 @@ def make_image_from_rom(working_ow, working_table):
     return final
 
 def create_palette_from_gba(palette_addr):
-    global rom
-    rom.seek(palette_addr)
-    palette = []
-
-    for i in range(0, 16):
-        byte1 = rom.read_byte()
-        byte2 = rom.read_byte()
-
-        color = byte1 * 256 + byte2
-        red, green, blue = gba_to_rgb(color)
-
-        palette.append(red)
-        palette.append(green)
-        palette.append(blue)
-
-    return palette
+    return decode_palette(rom.read_slice(palette_addr, 32))
 
 def is_palette_used(palette_id):
-    global root
-    # Search all the tables
-    for table in root.tables_list:
-        # Search all the ows
-        for ow in table.ow_data_ptrs:
-            if get_ow_palette_id(ow.ow_data_addr) == palette_id:
-                return 1
+    if palette_usage.is_used(root.tables_list, palette_id):
+        return 1
     return 0
 
 def get_used_pals():
-    used_pals = set()
-    global root
-    # Search all the tables
-    for table in root.tables_list:
-        for ow in table.ow_data_ptrs:
-            used_pals.add(get_ow_palette_id(ow.ow_data_addr))
-    return used_pals
+    return palette_usage.used_ids(root.tables_list)
 
 
 # === Classes ===
+class PaletteTable:
+    # Parsed palette table, the slots are re-read from the lowest written one
+    def __init__(self, game):
+        self.table_addr = None
+        # Palette id of every slot before the end of the table
+        self.ids = []
+        # palette id -> first slot
+        self.slots = {}
+        self.max_id = -1
+        # Leading slots that are palette ptrs
+        self.palette_num = 0
+        self.end = 0
+        self.free_slots = 0
+        # GBA colors -> slot, built on the first lookup
+        self.by_colors = None
+        # Lowest written addr since the last sync
+        self.dirty_from = None
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.table_addr = None
+        self.by_colors = None
+        self.dirty_from = None
+
+    def touch(self, start, end):
+        if self.table_addr is None or end <= self.table_addr or start >= self.limit():
+            return
+        start = max(start, self.table_addr)
+        if self.dirty_from is None or start < self.dirty_from:
+            self.dirty_from = start
+
+    def limit(self):
+        # Past the last byte the index depends on
+        free_end = self.table_addr + (self.palette_num + self.free_slots + 2) * 8
+        return max(self.end + 8, free_end)
+
+    def load(self, table_addr):
+        if table_addr != self.table_addr:
+            self.table_addr = table_addr
+            self.ids = []
+            self.slots = {}
+            self.max_id = -1
+            self.palette_num = 0
+            self.by_colors = None
+            self.dirty_from = table_addr
+        self.sync()
+        return self
+
+    def sync(self):
+        if self.dirty_from is None:
+            return
+        slot = (self.dirty_from - self.table_addr) // 8
+        self.dirty_from = None
+
+        if slot < len(self.ids):
+            del self.ids[slot:]
+            self.palette_num = min(self.palette_num, slot)
+            self.slots = {}
+            for i, palette_id in enumerate(self.ids):
+                self.slots.setdefault(palette_id, i)
+            self.max_id = max(self.ids, default=-1)
+            self.by_colors = None
+
+        working_addr = self.table_addr + len(self.ids) * 8
+        while is_palette_table_end(working_addr) == 0:
+            palette_id = get_palette_id(working_addr)
+            if self.palette_num == len(self.ids) and is_ptr(working_addr):
+                self.palette_num += 1
+                colors = self.get_colors(working_addr)
+                if self.by_colors is not None and colors is not None:
+                    self.by_colors.setdefault(colors, len(self.ids))
+            self.slots.setdefault(palette_id, len(self.ids))
+            self.max_id = max(self.max_id, palette_id)
+            self.ids.append(palette_id)
+            working_addr += 8
+        self.end = working_addr
+
+        addr = self.table_addr + self.palette_num * 8 + 8
+        self.free_slots = 0
+        while rom.read_slice(addr, 8) == bytes(8):
+            addr += 8
+            self.free_slots += 1
+
+    def get_palette_addr(self, palette_id):
+        slot = self.slots.get(palette_id)
+        if slot is None:
+            return 0
+        return self.table_addr + slot * 8
+
+    def used_palettes(self):
+        return self.ids[:self.palette_num]
+
+    def get_colors(self, palette_addr):
+        # None if the pointer of the slot is out of the ROM
+        try:
+            return rom.read_slice(ptr_to_addr(palette_addr), PALETTE_SIZE)
+        except IndexError:
+            return None
+
+    def index_colors(self):
+        self.by_colors = {}
+        for slot in range(0, self.palette_num):
+            colors = self.get_colors(self.table_addr + slot * 8)
+            if colors is not None:
+                self.by_colors.setdefault(colors, slot)
+
+    def find_colors(self, colors):
+        # Id of a palette with exactly these GBA colors, None if there isn't one
+        if self.by_colors is None:
+            self.index_colors()
+
+        slot = self.by_colors.get(colors)
+        # The colors might have been written since
+        if slot is not None and self.get_colors(self.table_addr + slot * 8) != colors:
+            self.index_colors()
+            slot = self.by_colors.get(colors)
+        if slot is None:
+            return None
+        return self.ids[slot]
+
+# The palette table of the ROM, shared by all the PaletteManagers
+palette_table = PaletteTable(rom)
+
+
 class PaletteManager:
     table_addr = 0x0
     palette_num = 0
@@ -333,6 +453,15 @@ class PaletteManager:
 
     def __init__(self):
         self.table_addr = ptr_to_addr(PAL_TBL_PTRS[0])
+
+        # An unchanged ROM already has the palette table in the cache
+        layout = analysis_cache.get(("palettes", self.table_addr))
+        if layout is not None:
+            self.palette_num, self.max_size, used_palettes = layout
+            self.free_slots = self.max_size - self.palette_num
+            self.used_palettes = list(used_palettes)
+            return
+
         self.palette_num = self.get_palette_num()
         self.max_size = self.get_max_size()
         self.free_slots = self.max_size - self.palette_num
@@ -344,107 +473,48 @@ class PaletteManager:
             self.repoint_palette_table()
 
         self.set_used_palettes()
+        analysis_cache.put(("palettes", self.table_addr),
+                           (self.palette_num, self.max_size, tuple(self.used_palettes)))
 
     def set_used_palettes(self):
-
-        self.used_palettes = []
-
-        working_addr = self.table_addr
-
-        while is_palette_table_end(working_addr) == 0 and is_palette_ptr(working_addr):
-            self.used_palettes.append(get_palette_id(working_addr))
-            working_addr += 8
+        self.used_palettes = palette_table.load(self.table_addr).used_palettes()
 
     def get_table_end(self):
-        working_addr = self.table_addr
-
-        while is_palette_table_end(working_addr) == 0:
-            working_addr += 8
-
-        return working_addr
+        return palette_table.load(self.table_addr).end
 
     def get_max_size(self):
-        # Go to the end of the table
-        working_addr = self.table_addr
-        while is_palette_table_end(working_addr) == 0:
-            working_addr += 8
-        working_addr += 8
-        # Now we are after the end of the palette table
-
-        i = self.get_free_slots()
-
-        return self.palette_num + i
+        table = palette_table.load(self.table_addr)
+        return table.palette_num + table.free_slots
 
     def get_free_slots(self):
-        addr = self.table_addr + self.get_palette_num() * 8 + 8
-
-        i = 0
-        done = 0
-        while done == 0:
-            adder = 0
-            rom.seek(addr)
-            for j in range(0, 8):
-                adder += rom.read_byte()
-
-            if adder != 0:
-                done = 1
-            else:
-                addr += 8
-                i += 1
-        return i
+        return palette_table.load(self.table_addr).free_slots
 
     def get_palette_num(self):
-        working_addr = self.table_addr
-        i = 0
-
-        while is_palette_table_end(working_addr) == 0 and is_ptr(working_addr):
-            if is_ptr(working_addr) == 1:
-                i += 1
-            working_addr += 8
-
-        return i
+        return palette_table.load(self.table_addr).palette_num
 
     def get_max_palette_id(self):
-        max_id = -1
-        working_addr = self.table_addr
-
-        while is_palette_table_end(working_addr) == 0:
-            if get_palette_id(working_addr) > max_id:
-                # Found new max
-                max_id = get_palette_id(working_addr)
-
-            working_addr += 8
-
-        return max_id
+        return palette_table.load(self.table_addr).max_id
 
     def get_palette_addr(self, palette_id):
-
-        working_addr = self.table_addr
-
-        while is_palette_table_end(working_addr) == 0:
-
-            if get_palette_id(working_addr) == palette_id:
-                return working_addr
-
-            working_addr += 8
-
-        return 0
+        return palette_table.load(self.table_addr).get_palette_addr(palette_id)
 
     def insert_rgb_to_gba_palette(self, palette):
 
         # Write the palette to the ROM
         palette_addr = find_free_space(16 * 4, FREE_SPC, 2)
-
-        working_addr = palette_addr
-        for i in range(0, 48, 3):
-            color = rgb_to_gba(palette[i], palette[i + 1], palette[i + 2])
-
-            write_color(color, working_addr)
-            working_addr += 2
+        rom.write_slice(palette_addr, encode_palette(palette))
 
         return palette_addr
 
     def import_palette(self, palette):
+        # Returns the id of the palette, an identical one is reused
+        palette_id = palette_table.load(self.table_addr).find_colors(encode_palette(palette))
+        if palette_id is not None:
+            return palette_id
+
+        # Only a new palette needs a free slot
+        if self.get_free_slots() == 0:
+            self.repoint_palette_table()
 
         # Import the palette in the ROM
         colors_addr = self.insert_rgb_to_gba_palette(palette)
@@ -462,6 +532,8 @@ class PaletteManager:
         write_palette_id(table_end, palette_id)
         write_bytes(table_end + 6, [0x0, 0x0])
 
+        return palette_id
+
     def repoint_palette_table(self):
 
         num_of_palettes = self.get_palette_num()
@@ -501,10 +573,12 @@ class ImageManager(PaletteManager):
         palette = pokemon.getpalette()
 
         # Insert the palette
-        self.import_palette(palette)
-        palette_id = self.get_max_palette_id()
+        palette_id = self.import_palette(palette)
         write_ow_palette_id(root.tables_list[working_table].ow_data_ptrs[working_ow].ow_data_addr, palette_id)
 
+        # Only sharing frames leaves OWs pointing to the same frames
+        if FRAME_DEDUP:
+            root.tables_list[working_table].ow_data_ptrs[working_ow].frames.unshare()
         working_addr = root.tables_list[working_table].ow_data_ptrs[working_ow].frames.frames_addr
         row = 3 * 32
         column = 0 * 32
@@ -560,6 +634,9 @@ class ImageManager(PaletteManager):
         working_addr += get_frame_size(2)
         import_frame(pokemon, working_addr, 2, row, column)
 
+        if FRAME_DEDUP:
+            share_frames(root.tables_list[working_table].ow_data_ptrs[working_ow])
+
         self.set_used_palettes()
 
     def import_sprites(self, sprite_image, working_table, working_ow):
@@ -574,11 +651,13 @@ class ImageManager(PaletteManager):
         palette = sprite.getpalette()
 
         # Insert the palette
-        self.import_palette(palette)
-        palette_id = self.get_max_palette_id()
+        palette_id = self.import_palette(palette)
         write_ow_palette_id(root.tables_list[working_table].ow_data_ptrs[working_ow].ow_data_addr, palette_id)
 
         # Import the frames
+        # Only sharing frames leaves OWs pointing to the same frames
+        if FRAME_DEDUP:
+            root.tables_list[working_table].ow_data_ptrs[working_ow].frames.unshare()
         working_addr = root.tables_list[working_table].ow_data_ptrs[working_ow].frames.frames_addr
 
         num_of_frames = root.tables_list[working_table].ow_data_ptrs[working_ow].frames.get_num()
@@ -593,6 +672,9 @@ class ImageManager(PaletteManager):
 
             working_addr += get_frame_size(sprite_type)
 
+        if FRAME_DEDUP:
+            share_frames(root.tables_list[working_table].ow_data_ptrs[working_ow])
+
         self.set_used_palettes()
 
     def import_ow(self, ow_image, working_table, working_ow):
@@ -607,10 +689,12 @@ class ImageManager(PaletteManager):
         palette = ow_image_indexed.getpalette()
 
         # Insert the palette
-        self.import_palette(palette)
-        palette_id = self.get_max_palette_id()
+        palette_id = self.import_palette(palette)
         write_ow_palette_id(root.tables_list[working_table].ow_data_ptrs[working_ow].ow_data_addr, palette_id)
 
+        # Only sharing frames leaves OWs pointing to the same frames
+        if FRAME_DEDUP:
+            root.tables_list[working_table].ow_data_ptrs[working_ow].frames.unshare()
         working_addr = root.tables_list[working_table].ow_data_ptrs[working_ow].frames.frames_addr
         row = 1 * 32
         column = 2 * 32
@@ -666,6 +750,9 @@ class ImageManager(PaletteManager):
         working_addr += get_frame_size(2)
         import_frame(ow_image_indexed, working_addr, 2, row, column)
 
+        if FRAME_DEDUP:
+            share_frames(root.tables_list[working_table].ow_data_ptrs[working_ow])
+
         self.set_used_palettes()
 
     def palette_cleanup(self):
@@ -687,24 +774,63 @@ class ImageManager(PaletteManager):
                 print("Image: Removing pal: "+HEX(palette_id))
                 unused_palettes_addres.append(working_addr + (i * 8))
 
-        # Delete all the unused palettes
-        for addr in reversed(unused_palettes_addres):
-            remove_palette(addr)
+        # Delete all the unused palettes at once
+        remove_palettes(unused_palettes_addres)
 
         self.set_used_palettes()
 
-    def get_ow_frame(self, ow_num, table_num, frame_num):
+    def get_frame_snapshot(self, ow_num, table_num, frame_num):
+        # The bytes and the palette of a frame, to decode it without the ROM
         ow_type = root.tables_list[table_num].ow_data_ptrs[ow_num].frames.get_type()
         frames_addr = root.tables_list[table_num].ow_data_ptrs[ow_num].frames.frames_addr
         width, height = get_frame_dimensions(ow_type)
+        frame_size = get_frame_size(ow_type)
+
+        palette_id = get_ow_palette_id(root.tables_list[table_num].ow_data_ptrs[ow_num].ow_data_addr)
+        palette_addr = self.get_palette_addr(palette_id)
+
+        data = rom.read_slice((frame_num * frame_size) + frames_addr, frame_size)
+        return data, get_palette(palette_addr), width, height
+
+    def get_ow_frame(self, ow_num, table_num, frame_num):
+        ow_type = root.tables_list[table_num].ow_data_ptrs[ow_num].frames.get_type()
+        frames_addr = root.tables_list[table_num].ow_data_ptrs[ow_num].frames.frames_addr
 
         # For the palette
         palette_id = get_ow_palette_id(root.tables_list[table_num].ow_data_ptrs[ow_num].ow_data_addr)
         palette_addr = self.get_palette_addr(palette_id)
-        sprite_palette = create_palette_from_gba(ptr_to_addr(palette_addr))
+
+        key = (frames_addr, ow_type, frame_num, palette_addr)
+        image = frame_cache.get(key)
+        if image is not None:
+            return image
+
+        width, height = get_frame_dimensions(ow_type)
+        colors_addr = ptr_to_addr(palette_addr)
+        sprite_palette = get_palette(palette_addr)
         frame_size = get_frame_size(ow_type)
+        im_addr = (frame_num * frame_size) + frames_addr
 
-        image = create_image_from_addr((frame_num * frame_size) + frames_addr, width, height)
+        image = create_image_from_addr(im_addr, width, height)
         image.putpalette(sprite_palette)
 
+        frame_cache.put(key, image, [(im_addr, im_addr + frame_size),
+                                     (palette_addr, palette_addr + 4),
+                                     (colors_addr, colors_addr + 32)], width * height)
         return image
+
+
+# The ImageManager shared by the window and the tree nodes
+sprite_manager = None
+
+def get_sprite_manager():
+    global sprite_manager
+    if sprite_manager is None:
+        sprite_manager = ImageManager()
+    return sprite_manager
+
+def new_sprite_manager():
+    # For a new ROM or profile, the palette table might be elsewhere
+    global sprite_manager
+    sprite_manager = ImageManager()
+    return sprite_manager
@@ -0,0 +1,119 @@
+"""
+On-disk cache of the results of analysing a ROM (offsets, table layouts,
+frames of the OWs, palette table), keyed by a hash of the ROM contents.
+A different ROM (or the same one after saving changes) has a different
+hash, so it just misses the cache.
+
+Each entry remembers the ROM ranges it was computed from and is dropped
+once a write touches them. Only entries computed from the ROM as it was
+loaded are stored on disk
+"""
+import hashlib
+import os
+import pickle
+from core_files.game import ExtentSet
+
+CACHE_PATH = "Files/Cache/"
+# Number of ROM versions kept on disk
+MAX_CACHE_FILES = 16
+CACHE_VERSION = 1
+
+
+class AnalysisCache:
+    def __init__(self, game, path=CACHE_PATH):
+        self.game = game
+        self.path = path
+        self.rom_hash = None
+        # key -> (value, ranges), ranges is None for "the whole ROM"
+        self.entries = {}
+        # The entries that describe the ROM as it was loaded, they
+        # stay true for this hash even after the ROM is modified
+        self.pristine = {}
+        self.pending = ExtentSet()
+        self.written = False
+        self.modified = False
+        self.loaded = False
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.rom_hash = None
+        self.entries = {}
+        self.pristine = {}
+        self.pending.clear()
+        self.written = False
+        self.modified = False
+        self.loaded = False
+
+    def touch(self, start, end):
+        self.written = True
+        if self.entries:
+            self.pending.add(start, end)
+
+    def sync(self):
+        if not len(self.pending):
+            return
+        pending = self.pending
+        for key in list(self.entries):
+            ranges = self.entries[key][1]
+            if ranges is None or any(pending.overlaps(start, end) for start, end in ranges):
+                del self.entries[key]
+        self.pending.clear()
+
+    def file_name(self):
+        return os.path.join(self.path, self.rom_hash + ".pkl")
+
+    def load(self):
+        # Reads the entries of this ROM, only while it matches the file
+        if self.loaded:
+            return
+        self.loaded = True
+        if self.written or self.game.rom_size == 0:
+            return
+
+        self.rom_hash = hashlib.blake2b(self.game.buffer(), digest_size=16).hexdigest()
+        try:
+            with open(self.file_name(), "rb") as f:
+                version, entries = pickle.load(f)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return
+        if version != CACHE_VERSION:
+            return
+        self.entries.update(entries)
+        self.pristine.update(entries)
+
+    def get(self, key):
+        self.load()
+        self.sync()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def put(self, key, value, ranges=None):
+        # ranges: the (start, end) ROM ranges value was computed from
+        self.load()
+        self.sync()
+        self.entries[key] = (value, ranges)
+        if not self.written and self.rom_hash is not None:
+            self.pristine[key] = (value, ranges)
+            self.modified = True
+
+    def save(self):
+        if not self.modified or self.rom_hash is None:
+            return
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.file_name(), "wb") as f:
+                pickle.dump((CACHE_VERSION, self.pristine), f)
+            self.modified = False
+            self.prune()
+        except OSError as e:
+            print("analysis_cache: Couldn't save the cache ({})".format(e))
+
+    def prune(self):
+        files = [os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(".pkl")]
+        files.sort(key=os.path.getmtime, reverse=True)
+        for old_file in files[MAX_CACHE_FILES:]:
+            os.remove(old_file)
@@ -1,5 +1,6 @@
 import mmap
 from core_files.rom_api import *
+from core_files.palette_usage import PaletteUsage
 
 TemplateList = ['Template1', 'Template2', 'Template3', 'Template4', 'Template5', 'Template6', 'Template7', 'Template8']
 
@@ -24,6 +25,9 @@ FRAMES_END = 0x2135F0
 # When repointing a table. Used in ow_initializer, repoint_table
 FRAMES_PTRS_PTRS = set()
 
+# palette id -> OWs, rebuilt whenever the OWs of a table are re-read
+palette_usage = PaletteUsage(rom)
+
 # ----------------------Functions------------------------------
 
 def change_core_info(ow_tbls_ptrs_tbl, files_path):
@@ -41,8 +45,10 @@ def change_core_info(ow_tbls_ptrs_tbl, files_path):
             template = mmap.mmap(temp.fileno(), 0)
             Templates.append(template)
 
-def update_free_space(size, start_addr=FREE_SPC):
+def update_free_space(size, start_addr=None):
     global FREE_SPC
+    if start_addr is None:
+        start_addr = FREE_SPC
     FREE_SPC = find_free_space(size, start_addr, 2)
 
 def find_free_space_update(size, start_addr=0, ending=0):
@@ -188,12 +194,18 @@ def clear_frames(addr, frames, size):
     print(HEX(addr))
     write_word(addr, 0xFFFFFFFF)
 
-def available_frames_ptr_addr(addr, num_of_frames):
-    rom.seek(addr)
+def frames_shared(frames_addr, frames_ptrs_addr=None):
+    # With the frame deduplication several OWs can point to the same frames,
+    # frames_ptrs_addr are the OW's own frames ptrs
+    for ptr_addr in pointers.pointers_to(frames_addr):
+        if ptr_addr != frames_ptrs_addr and is_frames_ptr(ptr_addr):
+            return 1
+    return 0
 
-    for i in range(1, (num_of_frames * 8) + 1):
-        if rom.read_byte() != 0x33:
-            return 0
+def available_frames_ptr_addr(addr, num_of_frames):
+    size = num_of_frames * 8
+    if rom.read_slice(addr, size) != b'\x33' * size:
+        return 0
     return 1
 
 def write_frames_end(addr):
@@ -232,11 +244,7 @@ def get_template(ow_type):
     return Templates[ow_type - 1]
 
 def get_ow_palette_id(addr):
-    rom.seek(addr + 2)
-    byte1 = rom.read_byte()
-    byte2 = rom.read_byte()
-
-    return (byte2 * 256) + byte1
+    return rom.read_u16(addr + 2)
 
 def addrs_filter(new_table, ow_data_addr, frames_ptrs, frames_addr):
     # 0xA000 is ~ 256 * (4 + 36 + FRAMES_PER_OW * 8)
@@ -264,22 +272,16 @@ def addrs_filter(new_table, ow_data_addr, frames_ptrs, frames_addr):
     return new_table, ow_data_addr, frames_ptrs, frames_addr
 
 def write_ow_palette_id(addr, palette_id):
-    rom.seek(addr + 2)
     byte1 = int(palette_id / 256)
     byte2 = int(palette_id % 256)
 
-    rom.write_byte(byte2)
-    rom.write_byte(byte1)
-    rom.flush()
+    write_bytes(addr + 2, [byte2, byte1])
 
 def is_frames_ptr(addr):
     check1 = is_ptr(addr)
 
     # It checks first the type of the frames from the data next to the ptr
-    frame = []
-
-    rom.seek(addr + 4)
-    frame = [rom.read_byte(), rom.read_byte()]
+    frame = list(rom.read_slice(addr + 4, 2))
 
     if frame == frametype1:
         tp = 1
@@ -305,8 +307,7 @@ def is_frames_ptr(addr):
     return tp * check1
 
 def get_palette_slot(data_addr):
-    rom.seek(data_addr + 12)
-    slot_compressed = rom.read_byte()
+    slot_compressed = rom.read_u8(data_addr + 12)
 
     return int(slot_compressed % 16)
 
@@ -434,10 +435,7 @@ class FramesPointers:
 
     def get_type(self):
         # It checks first the type of the frames from the data next to the ptr
-        frame = []
-
-        rom.seek(self.frames_ptrs_addr + 4)
-        frame = [rom.read_byte(), rom.read_byte()]
+        frame = list(rom.read_slice(self.frames_ptrs_addr + 4, 2))
 
         tp = -1
         if frame == frametype1:
@@ -463,6 +461,11 @@ class FramesPointers:
         return tp
 
     def get_num(self):
+        key = ("frames", self.frames_ptrs_addr, self.frames_addr)
+        num = analysis_cache.get(key)
+        if num is not None:
+            return num
+
         ow_type = self.get_type()
         size = get_frame_size(ow_type)
 
@@ -475,8 +478,39 @@ class FramesPointers:
 
             # if (addr == 0xc6921a):
             #     print("HELLOOOOO")
+
+        # Valid until the type or the frames (up to FRAMES_END) change
+        analysis_cache.put(key, i, [(self.frames_ptrs_addr + 4, self.frames_ptrs_addr + 6),
+                                    (self.frames_addr, addr + 4)])
         return i
 
+    def share(self, frames_addr):
+        # Points the frames ptrs to identical frames at frames_addr
+        ow_type = self.get_type()
+        frames_num = self.get_num()
+        old_frames_addr = self.frames_addr
+
+        self.frames_addr = frames_addr
+        self.write_frames_ptrs(ow_type, frames_num)
+
+        if not frames_shared(old_frames_addr):
+            clear_frames(old_frames_addr, frames_num, get_frame_size(ow_type))
+
+    def unshare(self):
+        # Gives the OW its own copy of shared frames, before writing them
+        if not frames_shared(self.frames_addr, self.frames_ptrs_addr):
+            return
+        ow_type = self.get_type()
+        frames_num = self.get_num()
+        size = frames_num * get_frame_size(ow_type)
+
+        frames_addr = self.find_frames_free_space(ow_type, frames_num)
+        copy_data(self.frames_addr, frames_addr, size)
+        write_ptr(FRAMES_END, frames_addr + size)
+
+        self.frames_addr = frames_addr
+        self.write_frames_ptrs(ow_type, frames_num)
+
     def clear(self):
         ow_type = self.get_type()
         frames_num = self.get_num()
@@ -484,7 +518,9 @@ class FramesPointers:
         # Clear the ptrs addr
         fill_with_data(self.frames_ptrs_addr, frames_num * 8, 0x33)
         # Clear the actual data of the frames, watch out for overlays
-        clear_frames(self.frames_addr, frames_num, get_frame_size(ow_type))
+        # and for other OWs still using them
+        if not frames_shared(self.frames_addr):
+            clear_frames(self.frames_addr, frames_num, get_frame_size(ow_type))
 
 class OWData:
     ow_ptr_addr = 0x0
@@ -569,6 +605,7 @@ class OWPointerTable:
         self.frames_addr = frames_addr
         self.ow_data_ptrs = []
         self.end_of_table = table_addr + (256 * 4)
+        palette_usage.invalidate()
 
         # Checks if the table was already there
         if ptr_to_addr(self.table_addr) == 0xFFFFFF:
@@ -621,6 +658,7 @@ class OWPointerTable:
     def re_initialize_ow(self):
         # Re-initialize the ow_ptrs
         self.ow_data_ptrs = []
+        palette_usage.invalidate()
 
         check_addr = self.table_addr
         while 1:
@@ -715,6 +753,14 @@ class Root:
         self.ow_tables_addr = TBL_0
         FRAMES_PTRS_PTRS = set()
 
+        # An unchanged ROM already has its tables in the cache
+        layout = analysis_cache.get(("tables", self.ow_tables_addr))
+        if layout is not None:
+            for table_info in layout:
+                self.ow_tables_addrs.append(table_info[1])
+                self.tables_list.append(OWPointerTable(*table_info))
+            return
+
         # Get addresses of OW Data Pointers Tables (Table 1)
         addr = self.ow_tables_addr
         ow_tbls_addrs = []  #[ptr:Table 1] or Table 0's entries
@@ -733,6 +779,8 @@ class Root:
                 # ROM that might be pointing to it
                 if addr == self.ow_tables_addr:
                     SHOW("Searching for Pointers for the Default OW Table")
+                    from core_files.rom_scanner import index_pointers
+                    index_pointers()
                     ptrs = find_ptr_in_rom(ptr_to_addr(addr), True)
                     self.repoint_table(addr)
                     for ptr in ptrs:
@@ -760,6 +808,12 @@ class Root:
             print("\nroot: About to check: {} ({})".format(HEX(addr), HEX(ptr_to_addr(addr))))
         print("\nroot: Not a ptr: {} ({})".format(HEX(addr), HEX(ptr_to_addr(addr))))
 
+        analysis_cache.put(("tables", self.ow_tables_addr), self.get_layout())
+
+    def get_layout(self):
+        return [(tbl.table_ptr_addr, tbl.table_addr, tbl.ow_data_addr, tbl.frames_ptrs_addr,
+                 tbl.frames_addr) for tbl in self.tables_list]
+
     def reload(self):
         self.tables_list = []
         self.ow_tables_addr = TBL_0
@@ -827,10 +881,12 @@ class Root:
         fill_with_data(addr, 4, 0)
 
         addr += 4
+        moves = []
         while is_table_ptr(addr):
             print("remove_table: Moving left ptr: "+HEX(addr))
-            move_data(addr, addr - 4, 4, 0)
+            moves.append((addr, addr - 4, 4))
             addr += 4
+        move_data_batch(moves, 0)
 
         # Re-initialise the entire root
         self.reload()
@@ -909,10 +965,9 @@ class Root:
             write_word(repointed_table.ow_data_ptrs[-1].ow_data_addr + 0x1C, new_frames_ptr)
 
             # Copy the actual frames
-            for j in range(frames[i]):
-                copy_data(ptr_to_addr(original_frames_ptrs[i] + (j * 8)),
-                          repointed_table.ow_data_ptrs[-1].frames.frames_addr + (j * get_frame_size(types[i])),
-                          get_frame_size(types[i]))
+            copy_data_batch([(ptr_to_addr(original_frames_ptrs[i] + (j * 8)),
+                              repointed_table.ow_data_ptrs[-1].frames.frames_addr + (j * get_frame_size(types[i])),
+                              get_frame_size(types[i])) for j in range(frames[i])])
 
         if len(frames) >= 218:
             SHOW("Paddding the extra OWs")
@@ -941,24 +996,19 @@ class Root:
 
             i += 1
 
-    def get_num_of_available_table_ptrs(self):
-
+    def scan_table_ptrs(self):
+        # Returns the number of free entries of Table 0 and the addr
+        # past them and the word that ends them
         check_addr = self.ow_tables_addr
 
         while is_ptr(check_addr) == 1:
             check_addr += 4
 
         i = 0
-        done = 0
-        while done == 0:
-            adder = 0
-            rom.seek(check_addr)
-            for j in range(0, 4):
-                adder += rom.read_byte()
-
-            if adder != 0:
-                done = 1
-            else:
-                check_addr += 4
-                i += 1
-        return i
+        while rom.read_u32(check_addr) == 0:
+            check_addr += 4
+            i += 1
+        return i, check_addr + 4
+
+    def get_num_of_available_table_ptrs(self):
+        return self.scan_table_ptrs()[0]
@@ -0,0 +1,203 @@
+"""
+Index of the free space (runs of 0xFF) in the ROM. It gets built with
+one scan the first time it is needed and then it is kept up to date
+through the writes, so an allocation doesn't have to rescan the ROM
+"""
+import re
+from bisect import bisect_left, bisect_right
+from core_files.game import ExtentSet
+
+# Shorter runs are not indexed, smaller requests use a plain search
+MIN_RUN = 16
+FREE_RUN = re.compile(b"\xff{%d,}" % MIN_RUN)
+ANY_RUN = re.compile(b"\xff+")
+# Bytes read at a time by the plain search
+SEARCH_CHUNK = 0x10000
+# The runs are grouped in blocks of the ROM by their start, for first fit
+BLOCK_SHIFT = 12
+
+
+def align_up(addr, align):
+    if align > 1 and addr % align:
+        addr += align - (addr % align)
+    return addr
+
+
+class RunTree:
+    # Segment tree with the longest run of every group of blocks, it finds
+    # the first block at or after another one with a run long enough in O(log n)
+    def __init__(self, lengths=()):
+        self.size = 1
+        while self.size < len(lengths):
+            self.size *= 2
+        self.tree = [0] * self.size + list(lengths) + [0] * (self.size - len(lengths))
+        for i in range(self.size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def set(self, k, length):
+        i = k + self.size
+        self.tree[i] = length
+        i //= 2
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+
+    def first_at_least(self, k, length):
+        # Lowest block >= k with a run of at least length bytes, None if there isn't one
+        if k >= self.size:
+            return None
+        tree = self.tree
+        i = k + self.size
+        while tree[i] < length:
+            # Up while it is a right child, then to the next subtree
+            while i & 1:
+                i //= 2
+                if i == 0:
+                    return None
+            i += 1
+        while i < self.size:
+            i = 2 * i if tree[2 * i] >= length else 2 * i + 1
+        return i - self.size
+
+
+class FreeSpaceIndex:
+    def __init__(self, game):
+        self.game = game
+        # Sorted maximal runs [start, end) of at least MIN_RUN 0xFFs
+        self.starts = []
+        self.ends = []
+        # Longest run starting in every block, for first fit
+        self.blocks = RunTree()
+        # Ranges written since the last sync
+        self.pending = ExtentSet()
+        self.built = False
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.starts = []
+        self.ends = []
+        self.blocks = RunTree()
+        self.pending.clear()
+        self.built = False
+
+    def touch(self, start, end):
+        if self.built:
+            self.pending.add(start, end)
+
+    def build(self):
+        self.reset()
+        for match in FREE_RUN.finditer(self.game.buffer()):
+            self.starts.append(match.start())
+            self.ends.append(match.end())
+        longest = [0] * ((self.game.rom_size >> BLOCK_SHIFT) + 1)
+        for run_start, run_end in zip(self.starts, self.ends):
+            block = run_start >> BLOCK_SHIFT
+            longest[block] = max(longest[block], run_end - run_start)
+        self.blocks = RunTree(longest)
+        self.built = True
+
+    def sync(self):
+        if not self.built:
+            self.build()
+            return
+        if not len(self.pending):
+            return
+        for start, end in self.pending:
+            self.update(start, end)
+        self.pending.clear()
+
+    def update(self, start, end):
+        # Re-index the written range. Untracked 0xFF stretches are shorter
+        # than MIN_RUN, so looking MIN_RUN bytes around it is enough
+        lo = max(0, start - MIN_RUN)
+        hi = min(self.game.rom_size, end + MIN_RUN)
+
+        i = bisect_left(self.ends, lo)
+        j = bisect_right(self.starts, hi)
+        # The parts of the old runs outside [lo, hi) are still 0xFF
+        left = lo
+        right = hi
+        if i < j:
+            left = min(self.starts[i], lo)
+            right = max(self.ends[j - 1], hi)
+
+        runs = [[lo + m.start(), lo + m.end()] for m in ANY_RUN.finditer(self.game.view(lo, hi - lo))]
+        if left < lo:
+            if runs and runs[0][0] == lo:
+                runs[0][0] = left
+            else:
+                runs.insert(0, [left, lo])
+        if right > hi:
+            if runs and runs[-1][1] == hi:
+                runs[-1][1] = right
+            else:
+                runs.append([hi, right])
+        runs = [run for run in runs if run[1] - run[0] >= MIN_RUN]
+
+        # Only the blocks where the old and the new runs start change
+        blocks = {run_start >> BLOCK_SHIFT for run_start in self.starts[i:j]}
+        blocks.update(run[0] >> BLOCK_SHIFT for run in runs)
+
+        self.starts[i:j] = [run[0] for run in runs]
+        self.ends[i:j] = [run[1] for run in runs]
+        for block in blocks:
+            self.blocks.set(block, max((self.ends[k] - self.starts[k] for k in range(*self.block_runs(block))),
+                                       default=0))
+
+    def block_runs(self, block):
+        # The range of runs that start in the block
+        return (bisect_left(self.starts, block << BLOCK_SHIFT),
+                bisect_left(self.starts, (block + 1) << BLOCK_SHIFT))
+
+    def fits(self, run_start, run_end, size, start_addr, align):
+        addr = align_up(max(run_start, start_addr), align)
+        if addr + size <= run_end:
+            return addr
+        return None
+
+    def first_fit(self, size, start_addr=0, align=1):
+        # Lowest address >= start_addr with size 0xFFs, aligned to align
+        if size < MIN_RUN:
+            return self.small_fit(size, start_addr, align)
+        self.sync()
+
+        first = bisect_right(self.ends, start_addr)
+        if first == len(self.starts):
+            return None
+        block = self.starts[first] >> BLOCK_SHIFT
+        while True:
+            block = self.blocks.first_at_least(block, size)
+            if block is None:
+                return None
+            start, end = self.block_runs(block)
+            for k in range(max(start, first), end):
+                if self.ends[k] - self.starts[k] < size:
+                    continue
+                # It can still miss by the alignment or by start_addr
+                addr = self.fits(self.starts[k], self.ends[k], size, start_addr, align)
+                if addr is not None:
+                    return addr
+            block += 1
+
+    def small_fit(self, size, start_addr, align):
+        # Searched a chunk at a time, so it doesn't need the whole ROM in one buffer
+        pattern = b"\xff" * max(size, 1)
+        chunk_start = start_addr
+        while chunk_start < self.game.rom_size:
+            chunk_end = min(chunk_start + SEARCH_CHUNK + len(pattern) - 1, self.game.rom_size)
+            buf = self.game.read_slice(chunk_start, chunk_end - chunk_start)
+            pos = buf.find(pattern)
+            while pos != -1:
+                addr = align_up(chunk_start + pos, align)
+                if addr + len(pattern) <= self.game.rom_size and \
+                        self.game.read_slice(addr, len(pattern)) == pattern:
+                    return addr
+                pos = buf.find(pattern, pos + 1)
+            chunk_start += SEARCH_CHUNK
+        return None
+
+    def total(self):
+        self.sync()
+        return sum(self.ends) - sum(self.starts)
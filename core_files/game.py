@@ -2,6 +2,208 @@
 """
 To organize all info about the game/ROM file in one place / Cosarara97's file
 """
+import mmap
+import os
+import struct
+from bisect import bisect_left, bisect_right
+
+# Little endian, like the GBA
+U16 = struct.Struct("<H")
+U32 = struct.Struct("<I")
+
+# Map the ROM file instead of reading it to memory. Off by default: the
+# mapping shares the file, so another tool rewriting the ROM while it is
+# open changes (or, if it gets shorter, crashes) the editor, and on
+# Windows it keeps the other tools from saving it
+USE_MMAP = False
+
+PAGE_SIZE = mmap.PAGESIZE
+PAGE_SHIFT = PAGE_SIZE.bit_length() - 1
+
+
+class ExtentSet:
+    """
+    Sorted set of disjoint [start, end) ranges.
+    Overlapping or touching ranges get merged
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        if start >= end:
+            return
+        starts, ends = self.starts, self.ends
+
+        # Sequential writes keep extending the last range
+        if ends and starts[-1] <= start <= ends[-1]:
+            if end > ends[-1]:
+                ends[-1] = end
+            return
+
+        i = bisect_left(ends, start)
+        j = bisect_right(starts, end)
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+        starts[i:j] = [start]
+        ends[i:j] = [end]
+
+    def overlaps(self, start, end):
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def clear(self):
+        self.starts = []
+        self.ends = []
+
+    def size(self):
+        return sum(self.ends) - sum(self.starts)
+
+    def __iter__(self):
+        return iter(list(zip(self.starts, self.ends)))
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class RomOverlay:
+    """
+    Read-only mapping of the ROM file. Writes land in private copies
+    of the touched pages, so the file is never modified and only the
+    edited pages take memory
+    """
+    def __init__(self, fn):
+        self.file = open(fn, "rb")
+        try:
+            self.base = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            self.file.close()
+            raise
+        self.size = len(self.base)
+        self.pages = {}
+        self.merged = None
+
+    def close(self):
+        self.pages = {}
+        self.merged = None
+        try:
+            self.base.close()
+        except BufferError:
+            # Someone still holds a view, let the GC close it
+            pass
+        self.file.close()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1:
+                return self.read(0, self.size)[key]
+            return self.read(start, max(stop - start, 0))
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError
+        page = self.pages.get(key >> PAGE_SHIFT)
+        if page is None:
+            return self.base[key]
+        return page[key & (PAGE_SIZE - 1)]
+
+    def __setitem__(self, key, val):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step != 1 or stop - start != len(val):
+                raise ValueError("RomOverlay can't resize or stride")
+            self.write(start, val)
+            return
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError
+        self.get_page(key >> PAGE_SHIFT)[key & (PAGE_SIZE - 1)] = val
+        self.merged = None
+
+    def get_page(self, page_num):
+        # Copy-on-write: the first write to a page copies it from the file
+        page = self.pages.get(page_num)
+        if page is None:
+            start = page_num << PAGE_SHIFT
+            page = bytearray(self.base[start:start + PAGE_SIZE])
+            self.pages[page_num] = page
+        return page
+
+    def is_clean(self, addr, size):
+        if not self.pages:
+            return True
+        first = addr >> PAGE_SHIFT
+        last = (addr + size - 1) >> PAGE_SHIFT
+        if last - first > len(self.pages):
+            return not any(first <= p <= last for p in self.pages)
+        return not any(p in self.pages for p in range(first, last + 1))
+
+    def read(self, addr, size):
+        if size <= 0:
+            return b""
+        if self.is_clean(addr, size):
+            return self.base[addr:addr + size]
+
+        chunks = []
+        end = addr + size
+        while addr < end:
+            page_num = addr >> PAGE_SHIFT
+            offset = addr & (PAGE_SIZE - 1)
+            length = min(PAGE_SIZE - offset, end - addr)
+            page = self.pages.get(page_num)
+            if page is None:
+                chunks.append(self.base[addr:addr + length])
+            else:
+                chunks.append(bytes(page[offset:offset + length]))
+            addr += length
+        return b"".join(chunks)
+
+    def write(self, addr, data):
+        data = memoryview(data).cast("B")
+        end = addr + len(data)
+        pos = 0
+        while addr < end:
+            offset = addr & (PAGE_SIZE - 1)
+            length = min(PAGE_SIZE - offset, end - addr)
+            page = self.get_page(addr >> PAGE_SHIFT)
+            page[offset:offset + length] = data[pos:pos + length]
+            pos += length
+            addr += length
+        self.merged = None
+
+    def unpack_from(self, st, addr):
+        if self.is_clean(addr, st.size):
+            return st.unpack_from(self.base, addr)
+        return st.unpack_from(self.read(addr, st.size))
+
+    def view(self, addr, size):
+        if self.is_clean(addr, size):
+            return memoryview(self.base)[addr:addr + size]
+        # Only the pages in the range, not a copy of the whole ROM
+        return memoryview(self.read(addr, size))
+
+    def buffer(self):
+        # The whole ROM as one buffer, for scans over everything
+        if not self.pages:
+            return self.base
+        if self.merged is None:
+            merged = bytearray(self.base)
+            for page_num, page in self.pages.items():
+                start = page_num << PAGE_SHIFT
+                merged[start:start + len(page)] = page
+            self.merged = merged
+        return self.merged
+
+    def find(self, sub, start=0):
+        return self.buffer().find(sub, start)
 
 
 class Game:
@@ -15,22 +217,83 @@ class Game:
         self.is_rom_open = 0
         self.rom_path = ""
         self.rom_size = 0
+        self.overlay = None
+
+        # Ranges written since the last save
+        self.dirty = ExtentSet()
+        # Objects with touch(start, end) and reset(), told about every write
+        self.listeners = []
 
         self.pos = 0
 
         if fn is not None:
             self.load_rom(fn)
 
-    def load_rom(self, fn):
-        with open(fn, "rb") as rom_file:
-            self.rom_contents = rom_file.read()
-        self.original_rom_contents = bytes(self.rom_contents)
+    def load_rom(self, fn, use_mmap=None):
+        if use_mmap is None:
+            use_mmap = USE_MMAP
+        self.close()
+
+        if use_mmap:
+            try:
+                self.overlay = RomOverlay(fn)
+            except (ValueError, OSError):
+                # Empty file or no mmap support, read it instead
+                self.overlay = None
+
+        if self.overlay is not None:
+            self.rom_contents = self.overlay
+            self.original_rom_contents = self.overlay.base
+        else:
+            with open(fn, "rb") as rom_file:
+                self.rom_contents = bytearray(rom_file.read())
+            self.original_rom_contents = None
 
-        self.rom_contents = bytearray(self.rom_contents)
         self.rom_size = len(self.rom_contents)
         self.rom_file_name = fn
         self.rom_code = self.rom_contents[0xAC:0xAC+4]
 
+        self.dirty.clear()
+        for listener in self.listeners:
+            listener.reset()
+
+    def save(self, fn=None):
+        # Patches only the modified ranges into the file
+        if fn is None:
+            fn = self.rom_file_name
+
+        if not os.path.exists(fn):
+            with open(fn, "wb") as rom_file:
+                rom_file.write(self.buffer())
+        else:
+            with open(fn, "r+b") as rom_file:
+                for start, end in self.dirty:
+                    data = self.read_slice(start, end - start)
+                    if hasattr(os, "pwrite"):
+                        os.pwrite(rom_file.fileno(), data, start)
+                    else:
+                        rom_file.seek(start)
+                        rom_file.write(data)
+        self.dirty.clear()
+
+    def add_listener(self, listener):
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def touch(self, start, end):
+        self.dirty.add(start, end)
+        for listener in self.listeners:
+            listener.touch(start, end)
+
+    def close(self):
+        if self.overlay is not None:
+            self.overlay.close()
+            self.overlay = None
+
     def seek(self, pos):
         if pos > self.rom_size:
             raise IndexError
@@ -43,20 +306,80 @@ class Game:
     def write_byte(self, val):
         if 0 <= val <= 255:
             self.rom_contents[self.pos] = val
+            self.touch(self.pos, self.pos + 1)
             self.pos += 1
 
     def check_byte(self, addr, val):
-        try:
-            self.seek(addr)
-            if self.read_byte() == val:
-                return 1
-            return 0
-        except IndexError:
-            return 0
+        if 0 <= addr < self.rom_size:
+            return int(self.rom_contents[addr] == val)
+        return 0
 
     def get(self, addr):
-        self.seek(addr)
-        return rom.read_byte()
+        return self.read_u8(addr)
+
+    # Bulk accessors: they work straight on the buffer
+    # and don't move the cursor. They throw IndexError
+    def check_range(self, addr, size):
+        if addr < 0 or addr + size > self.rom_size:
+            raise IndexError
+
+    def read_u8(self, addr):
+        self.check_range(addr, 1)
+        return self.rom_contents[addr]
+
+    def unpack_from(self, st, addr):
+        self.check_range(addr, st.size)
+        if self.overlay is not None:
+            return self.overlay.unpack_from(st, addr)
+        return st.unpack_from(self.rom_contents, addr)
+
+    def read_u16(self, addr):
+        return self.unpack_from(U16, addr)[0]
+
+    def read_u32(self, addr):
+        return self.unpack_from(U32, addr)[0]
+
+    def read_ptr(self, addr):
+        # Decodes a 0x08/0x09 pointer to a ROM offset
+        word = self.read_u32(addr)
+        if word >> 24 == 9:
+            return (word & 0xFFFFFF) + 0x1000000
+        return word & 0xFFFFFF
+
+    def read_slice(self, addr, size):
+        self.check_range(addr, size)
+        if self.overlay is not None:
+            return self.overlay.read(addr, size)
+        return bytes(memoryview(self.rom_contents)[addr:addr + size])
+
+    def view(self, addr=0, size=None):
+        # Zero-copy view, don't hold it across writes
+        if size is None:
+            size = self.rom_size - addr
+        self.check_range(addr, size)
+        if self.overlay is not None:
+            return self.overlay.view(addr, size)
+        return memoryview(self.rom_contents)[addr:addr + size]
+
+    def buffer(self):
+        # The current contents of the whole ROM as one buffer
+        if self.overlay is not None:
+            return self.overlay.buffer()
+        return self.rom_contents
+
+    def write_slice(self, addr, data):
+        self.check_range(addr, len(data))
+        if self.overlay is not None:
+            self.overlay.write(addr, data)
+        else:
+            self.rom_contents[addr:addr + len(data)] = data
+        self.touch(addr, addr + len(data))
+
+    def write_u32(self, addr, val):
+        self.write_slice(addr, U32.pack(val & 0xFFFFFFFF))
+
+    def find(self, sub, start=0):
+        return self.rom_contents.find(sub, start)
 
     def flush(self):
         pass
@@ -0,0 +1,89 @@
+"""
+Snapshots of what the side menus show for the selected OW and for the
+tables: type, number of frames, palette and the free Table 0 entries.
+Reading them walks the frames up to FRAMES_END and scans Table 0, so
+they are computed once and dropped when a write touches the ROM ranges
+they were read from. A moved OW or table has other addrs, so other keys
+"""
+from core_files import ImageEditor
+from core_files.ImageEditor import get_frame_dimensions, get_frame_size, get_ow_palette_id, get_text_color, \
+    get_footprint, get_palette_slot, palette_table, rom
+from core_files.range_cache import RangeCache
+
+# Number of snapshots kept, every snapshot costs 1
+INSPECTOR_ENTRIES = 256
+# Size of the OW Data
+OW_DATA_SIZE = 0x24
+
+
+class OWSnapshot:
+    def __init__(self, ow, manager):
+        frames = ow.frames
+        self.ow_ptr_addr = ow.ow_ptr_addr
+        self.ow_data_addr = ow.ow_data_addr
+        self.frames_ptrs_addr = frames.frames_ptrs_addr
+        self.frames_addr = frames.frames_addr
+
+        self.ow_type = frames.get_type()
+        self.width, self.height = get_frame_dimensions(self.ow_type)
+        self.frames_num = frames.get_num()
+        self.frames_size = self.frames_num * (get_frame_size(self.ow_type) or 0)
+
+        self.palette_id = get_ow_palette_id(self.ow_data_addr)
+        self.palette_addr = manager.get_palette_addr(self.palette_id)
+        self.palette_slot = get_palette_slot(self.ow_data_addr)
+        self.text_color = get_text_color(self.ow_data_addr)
+        self.footprint = get_footprint(self.ow_data_addr)
+
+    def ranges(self):
+        return [(self.ow_ptr_addr, self.ow_ptr_addr + 4),
+                (self.ow_data_addr, self.ow_data_addr + OW_DATA_SIZE),
+                (self.frames_ptrs_addr + 4, self.frames_ptrs_addr + 6),
+                # Up to the FRAMES_END after them
+                (self.frames_addr, self.frames_addr + self.frames_size + 4),
+                (palette_table.table_addr, palette_table.limit())]
+
+
+class TablesSnapshot:
+    def __init__(self, root, manager):
+        self.ow_tables_addr = root.ow_tables_addr
+        self.tables_num = root.tables_num()
+        self.available_table_ptrs, self.table_ptrs_end = root.scan_table_ptrs()
+
+        self.palette_table_addr = manager.table_addr
+        self.palette_num = manager.get_palette_num()
+
+    def ranges(self):
+        return [(self.ow_tables_addr, self.table_ptrs_end),
+                (palette_table.table_addr, palette_table.limit())]
+
+
+class Inspector:
+    def __init__(self, game):
+        self.snapshots = RangeCache(game, INSPECTOR_ENTRIES)
+
+    def ow(self, manager, table_id, ow_id):
+        ow = ImageEditor.root.tables_list[table_id].ow_data_ptrs[ow_id]
+        key = ("ow", ow.ow_ptr_addr, ow.ow_data_addr, ow.frames.frames_ptrs_addr, ow.frames.frames_addr,
+               manager.table_addr)
+        palette_table.load(manager.table_addr)
+
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            snapshot = OWSnapshot(ow, manager)
+            self.snapshots.put(key, snapshot, snapshot.ranges(), 1)
+        return snapshot
+
+    def tables(self, manager):
+        root = ImageEditor.root
+        key = ("tables", root.ow_tables_addr, root.tables_num(), manager.table_addr)
+        palette_table.load(manager.table_addr)
+
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            snapshot = TablesSnapshot(root, manager)
+            self.snapshots.put(key, snapshot, snapshot.ranges(), 1)
+        return snapshot
+
+
+inspector = Inspector(rom)
@@ -0,0 +1,62 @@
+"""
+GBA palettes: 16 little endian BGR555 colors. The colors are converted
+with precomputed tables and a whole palette at a time, and the decoded
+palettes are cached per palette table entry
+"""
+import sys
+from array import array
+from core_files.rom_api import rom, ptr_to_addr
+from core_files.range_cache import RangeCache
+
+PALETTE_SIZE = 32
+# Number of decoded palettes kept
+PALETTE_CACHE_SIZE = 1024
+
+# BGR555 -> R, G, B (3 bytes per color)
+GBA_TO_RGB = bytes(channel for color in range(0x8000)
+                   for channel in ((color & 31) << 3, ((color >> 5) & 31) << 3, ((color >> 10) & 31) << 3))
+# 8 bit channel -> 5 bit channel
+RGB_TO_5BIT = bytes(i >> 3 for i in range(256))
+
+# Every palette costs 1, so the cache holds PALETTE_CACHE_SIZE of them
+palette_cache = RangeCache(rom, PALETTE_CACHE_SIZE)
+
+
+def gba_color_to_rgb(color):
+    i = (color & 0x7FFF) * 3
+    return tuple(GBA_TO_RGB[i:i + 3])
+
+
+def decode_palette(data):
+    # data: the GBA colors, returns [r, g, b, r, g, b, ...] like PIL's getpalette
+    colors = array("H")
+    colors.frombytes(bytes(data[:len(data) - len(data) % 2]))
+    if sys.byteorder == "big":
+        colors.byteswap()
+
+    palette = bytearray()
+    for color in colors:
+        i = (color & 0x7FFF) * 3
+        palette += GBA_TO_RGB[i:i + 3]
+    return list(palette)
+
+
+def encode_palette(palette, num_of_colors=16):
+    # palette: [r, g, b, r, g, b, ...], returns the GBA colors
+    channels = bytes(palette[:num_of_colors * 3]).translate(RGB_TO_5BIT)
+    colors = array("H", [red | (green << 5) | (blue << 10) for red, green, blue in
+                         zip(channels[0::3], channels[1::3], channels[2::3])])
+    if sys.byteorder == "big":
+        colors.byteswap()
+    return colors.tobytes()
+
+
+def get_palette(palette_addr):
+    # palette_addr: the entry in the palette table
+    palette = palette_cache.get(palette_addr)
+    if palette is None:
+        colors_addr = ptr_to_addr(palette_addr)
+        palette = tuple(decode_palette(rom.read_slice(colors_addr, PALETTE_SIZE)))
+        palette_cache.put(palette_addr, palette, [(palette_addr, palette_addr + 4),
+                                                  (colors_addr, colors_addr + PALETTE_SIZE)], 1)
+    return list(palette)
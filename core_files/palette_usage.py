@@ -0,0 +1,99 @@
+"""
+Reverse index of the palettes: palette id -> the OWs using it. It is
+built from the tables of the Root and kept up to date through the writes
+to the palette id of the OWs. Adding, removing or moving OWs rebuilds the
+OW lists of the tables, so they invalidate it
+"""
+from bisect import bisect_left
+from core_files.game import ExtentSet
+
+# Offset of the palette id in the OW Data
+PALETTE_ID_OFFSET = 2
+
+
+class PaletteUsage:
+    def __init__(self, game):
+        self.game = game
+        self.tables = None
+        # Sorted OW Data addrs
+        self.addrs = []
+        # ow_data_addr -> (table_id, ow_id)
+        self.refs = {}
+        # ow_data_addr -> palette id
+        self.ids = {}
+        # palette id -> set of ow_data_addrs
+        self.users = {}
+        self.pending = ExtentSet()
+        self.built = False
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.invalidate()
+
+    def touch(self, start, end):
+        if self.built:
+            self.pending.add(start, end)
+
+    def invalidate(self):
+        self.built = False
+        self.pending.clear()
+
+    def build(self, tables_list):
+        self.tables = tables_list
+        self.addrs = []
+        self.refs = {}
+        self.ids = {}
+        self.users = {}
+        self.pending.clear()
+        for table_id, table in enumerate(tables_list):
+            for ow_id, ow in enumerate(table.ow_data_ptrs):
+                self.refs[ow.ow_data_addr] = (table_id, ow_id)
+                self.set_id(ow.ow_data_addr)
+        self.addrs = sorted(self.refs)
+        self.built = True
+
+    def sync(self, tables_list):
+        if not self.built or tables_list is not self.tables:
+            self.build(tables_list)
+            return
+        if not len(self.pending):
+            return
+        for start, end in self.pending:
+            i = bisect_left(self.addrs, start - PALETTE_ID_OFFSET - 1)
+            while i < len(self.addrs) and self.addrs[i] + PALETTE_ID_OFFSET < end:
+                self.set_id(self.addrs[i])
+                i += 1
+        self.pending.clear()
+
+    def set_id(self, ow_data_addr):
+        old_id = self.ids.get(ow_data_addr)
+        if old_id is not None:
+            self.users[old_id].discard(ow_data_addr)
+            if not self.users[old_id]:
+                del self.users[old_id]
+        try:
+            palette_id = self.game.read_u16(ow_data_addr + PALETTE_ID_OFFSET)
+        except IndexError:
+            self.ids.pop(ow_data_addr, None)
+            return
+        self.ids[ow_data_addr] = palette_id
+        self.users.setdefault(palette_id, set()).add(ow_data_addr)
+
+    def ows_using(self, tables_list, palette_id):
+        # Sorted (table_id, ow_id) of the OWs with that palette
+        self.sync(tables_list)
+        return sorted(self.refs[addr] for addr in self.users.get(palette_id, ()))
+
+    def ow_data_addrs_using(self, tables_list, palette_id):
+        self.sync(tables_list)
+        return sorted(self.users.get(palette_id, ()))
+
+    def is_used(self, tables_list, palette_id):
+        self.sync(tables_list)
+        return palette_id in self.users
+
+    def used_ids(self, tables_list):
+        self.sync(tables_list)
+        return set(self.users)
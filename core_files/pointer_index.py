@@ -0,0 +1,155 @@
+"""
+Reverse index of the pointers in the ROM: target address -> word aligned
+addresses holding a 0x08/0x09 pointer to it. It is built lazily with one
+pass over the ROM and patched through the writes afterwards
+"""
+import re
+import sys
+from array import array
+from bisect import bisect_left, insort
+from core_files.game import ExtentSet
+
+PTR_PREFIX = re.compile(b"[\x08\x09]")
+
+
+def decode_ptr(word):
+    if word >> 24 == 9:
+        return (word & 0xFFFFFF) + 0x1000000
+    return word & 0xFFFFFF
+
+
+def find_ptr_words(buf, start=0, end=None):
+    # Yields (addr, target) for the aligned pointer words in buf[start:end]
+    if end is None:
+        end = len(buf)
+    start -= start % 4
+    end -= end % 4
+    if end <= start:
+        return
+
+    # The high bytes of all the aligned words, searched in one go
+    words = array("I")
+    words.frombytes(buf[start:end])
+    if sys.byteorder == "big":
+        words.byteswap()
+    high_bytes = bytes(memoryview(buf)[start + 3:end:4])
+
+    for match in PTR_PREFIX.finditer(high_bytes):
+        i = match.start()
+        yield start + i * 4, decode_ptr(words[i])
+
+
+def pack_ptr_words(found):
+    # (addr, target) pairs -> two arrays of words as bytes, cheap to pickle
+    addrs = array("I")
+    targets = array("I")
+    for addr, target in found:
+        addrs.append(addr)
+        targets.append(target)
+    return addrs.tobytes(), targets.tobytes()
+
+
+def unpack_ptr_words(packed):
+    # packed: the pack_ptr_words results of every chunk, in order
+    for addrs_bytes, targets_bytes in packed:
+        addrs = array("I")
+        addrs.frombytes(addrs_bytes)
+        targets = array("I")
+        targets.frombytes(targets_bytes)
+        yield from zip(addrs, targets)
+
+
+class PointerIndex:
+    def __init__(self, game):
+        self.game = game
+        # target -> sorted list of ptr addrs
+        self.refs = {}
+        # ptr addr -> target
+        self.targets = {}
+        self.pending = ExtentSet()
+        self.built = False
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.refs = {}
+        self.targets = {}
+        self.pending.clear()
+        self.built = False
+
+    def touch(self, start, end):
+        if self.built:
+            self.pending.add(start, end)
+
+    def build(self, packed=None):
+        # packed: the pointer words already collected by a scan, see pack_ptr_words
+        self.reset()
+        if packed is None:
+            found = find_ptr_words(self.game.buffer())
+        else:
+            found = unpack_ptr_words(packed)
+        for addr, target in found:
+            self.add(addr, target)
+        self.built = True
+
+    def sync(self):
+        if not self.built:
+            self.build()
+            return
+        if not len(self.pending):
+            return
+        for start, end in self.pending:
+            self.update(start, end)
+        self.pending.clear()
+
+    def add(self, addr, target):
+        self.targets[addr] = target
+        refs = self.refs.get(target)
+        if refs is None:
+            self.refs[target] = [addr]
+        elif refs[-1] < addr:
+            refs.append(addr)
+        else:
+            insort(refs, addr)
+
+    def remove(self, addr):
+        target = self.targets.pop(addr, None)
+        if target is None:
+            return
+        refs = self.refs[target]
+        del refs[bisect_left(refs, addr)]
+        if not refs:
+            del self.refs[target]
+
+    def update(self, start, end):
+        # Re-read every aligned word the range touches
+        start -= start % 4
+        end = min(end + (-end % 4), self.game.rom_size - self.game.rom_size % 4)
+        if len(self.targets) < (end - start) // 4:
+            for addr in [a for a in self.targets if start <= a < end]:
+                self.remove(addr)
+        else:
+            for addr in range(start, end, 4):
+                self.remove(addr)
+        if end <= start:
+            return
+        buf = self.game.view(start, end - start)
+        for addr, target in find_ptr_words(buf):
+            self.add(start + addr, target)
+
+    def pointers_to(self, target):
+        self.sync()
+        return list(self.refs.get(target, ()))
+
+    def first_pointer_to(self, target):
+        self.sync()
+        refs = self.refs.get(target)
+        if refs:
+            return refs[0]
+        return None
+
+    def pointers(self):
+        # All the (addr, target) pairs, by address
+        self.sync()
+        return sorted(self.targets.items())
@@ -0,0 +1,70 @@
+"""
+LRU of values computed from the ROM: decoded frames, palettes, hashes,
+snapshots. Every entry remembers the ROM ranges it was computed from and
+a write to any of them drops it. Each entry has a cost chosen by the
+cache that uses it (pixels, or 1 to count entries) and the least
+recently used entries go once the total passes max_cost
+"""
+from collections import OrderedDict
+from core_files.game import ExtentSet
+
+
+class RangeCache:
+    def __init__(self, game, max_cost):
+        self.game = game
+        self.max_cost = max_cost
+        # key -> (value, ranges, cost), the oldest first
+        self.entries = OrderedDict()
+        self.total_cost = 0
+        self.pending = ExtentSet()
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.entries.clear()
+        self.total_cost = 0
+        self.pending.clear()
+
+    def touch(self, start, end):
+        if self.entries:
+            self.pending.add(start, end)
+
+    def sync(self):
+        if not len(self.pending):
+            return
+        pending = self.pending
+        for key in list(self.entries):
+            if any(pending.overlaps(start, end) for start, end in self.entries[key][1]):
+                self.remove(key)
+        self.pending.clear()
+
+    def remove(self, key):
+        value, ranges, cost = self.entries.pop(key)
+        self.total_cost -= cost
+
+    def get(self, key):
+        self.sync()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, ranges, cost):
+        self.sync()
+        if key in self.entries:
+            self.remove(key)
+        if cost > self.max_cost:
+            return
+        self.entries[key] = (value, ranges, cost)
+        self.total_cost += cost
+        self.evict()
+
+    def evict(self):
+        while self.total_cost > self.max_cost:
+            self.remove(next(iter(self.entries)))
+
+    def set_max_cost(self, max_cost):
+        self.max_cost = max_cost
+        self.evict()
@@ -1,8 +1,14 @@
 from core_files.game import *
+from core_files.free_space import FreeSpaceIndex
+from core_files.pointer_index import PointerIndex
+from core_files.analysis_cache import AnalysisCache
 from random import randint
 
 global rom
 rom = Game()
+free_space = FreeSpaceIndex(rom)
+pointers = PointerIndex(rom)
+analysis_cache = AnalysisCache(rom)
 global prntbar
 prntbar = ""
 
@@ -22,79 +28,13 @@ def SHOW(msg):
 # Functions may throw IndexError
 def get_word(addr):
     # Big endian
-    rom.seek(addr)
-    byte1 = rom.read_byte() << 24
-    byte2 = rom.read_byte() << 16
-    byte3 = rom.read_byte() << 8
-    byte4 = rom.read_byte()
-    return byte4 | byte3 | byte2 | byte1
+    return int.from_bytes(rom.read_slice(addr, 4), "big")
 
 # Free Space Searching
-def aggressive_search(size, start_addr=0, ending=0):
-    # Searches really fast, but may not be able to find
-    # the free space, even if it exists in the ROM
-    size += ending
-    free_spc = [0xFF for i in range(size)]
-
-    # Search by Blocks
-    for addr in range(start_addr, rom.rom_size, size):
-        if not rom.check_byte(addr, 0xFF):
-            continue
-        if not rom.check_byte(addr, 0xFF):
-            continue
-        if not rom.check_byte(addr, 0xFF):
-            continue
-
-        # Search that spectrum for the FFs
-        addr = max(addr - size, start_addr)
-        ffs = 0
-        candidate_addr = addr
-        for i in range(addr, addr + 2*size):
-            if ffs == size:
-                if (ending != 0) and (candidate_addr % ending != 0):
-                    candidate_addr += candidate_addr % ending
-                return candidate_addr
-
-            if not rom.check_byte(i, 0xFF):
-                candidate_addr = i + 1
-                ffs = 0
-            else:
-                ffs += 1
-
-    return None
-
-def slow_search(size, start_addr=0, ending=0):
-    # Linear search for free space. If the needed space exists after the
-    # start_addr it will always find it. Significantly slower but reliable
-    working_addr = start_addr
-    target_addr = start_addr
-    ffs = 0
-    while ffs < size + ending:
-        if rom.check_byte(working_addr, 0xFF):
-            ffs += 1
-        else:
-            ffs = 0
-            target_addr = working_addr + 1
-        working_addr += 1
-
-        if working_addr > rom.rom_size:
-            return None
-
-    if (ending != 0) and (target_addr % ending != 0):
-        target_addr += target_addr % ending
-    return target_addr
-
 def find_free_space(size, start_addr=0, ending=0):
-    # First try the fast search and if that fails, use the slow one
-    addr = aggressive_search(size, start_addr, ending)
-    if addr: return addr
-    if not start_addr: addr = aggressive_search(size, 0, ending)
-    if not start_addr and addr: return addr
-
-    addr = slow_search(size, start_addr, ending)
-    if addr: return addr
-    if not start_addr: addr = slow_search(size, 0, ending)
-    if not start_addr and addr: return addr
+    # First fit after start_addr, aligned to ending (if given)
+    addr = free_space.first_fit(size, start_addr, max(ending, 1))
+    if addr is not None: return addr
 
     # The ROM is seriously running out of space
     SHOW("ERROR: No Free Space available. Closing")
@@ -104,8 +44,7 @@ def find_free_space(size, start_addr=0, ending=0):
 
 def is_ptr(addr):
     try:
-        rom.seek(addr + 3)
-        byte = rom.read_byte()
+        byte = rom.read_u8(addr + 3)
         if (byte == 8) or (byte == 9):
             return 1
         return 0
@@ -127,63 +66,32 @@ def get_bytes_bits(byte, bit, to=0):
     return result
 
 def write_word(addr, value):
-    rom.seek(addr)
-
-    for i in range(0, 4):
-        byte = get_bytes_bits(value, 1, 8)
-        rom.write_byte(byte)
-        value >>= 8
+    rom.write_u32(addr, value)
 
 def write_ptr(ptr_addr, addr_to_write):
     write_word(addr_to_write, ptr_addr + 0x08000000)
 
 def read_word(addr):
-    rom.seek(addr)
-    byte1 = rom.read_byte()
-
-    byte2 = rom.read_byte()
-    byte2 <<= 8
-
-    byte3 = rom.read_byte()
-    byte3 <<= 16
-
-    byte4 = rom.read_byte()
-    byte4 <<= 24
-
-    return byte1 + byte2 + byte3 + byte4
+    return rom.read_u32(addr)
 
 def read_half(addr):
-    rom.seek(addr)
-    return rom.read_byte() + (rom.read_byte() << 8)
+    return rom.read_u16(addr)
 
 def read_byte(addr):
-    rom.seek(addr)
-    return rom.read_byte()
+    return rom.read_u8(addr)
 
 def write_byte(addr, val):
     rom.seek(addr)
     rom.write_byte(val)
 
 def read_bytes(addr, num):
-    rom.seek(addr)
-    return [rom.read_byte() for _ in range(num)]
+    return list(rom.read_slice(addr, num))
 
-def write_bytes(addr, bytes):
-    rom.seek(addr)
-    for byte in bytes:
-        rom.write_byte(byte)
+def write_bytes(addr, bytes_to_write):
+    rom.write_slice(addr, bytes(bytes_to_write))
 
 def ptr_to_addr(addr):
-    rom.seek(addr)
-    byte1 = rom.read_byte()
-    byte2 = rom.read_byte() << 8
-    byte3 = rom.read_byte() << 16
-    subfix = rom.read_byte()
-
-    if subfix == 9:
-        return byte3 + byte2 + byte1 + 0x1000000
-    else:
-        return byte3 + byte2 + byte1
+    return rom.read_ptr(addr)
 
 def ptr_to_addr_n(addr, n):
     for i in range(1, n + 1):
@@ -191,28 +99,17 @@ def ptr_to_addr_n(addr, n):
     return addr
 
 def find_bytes_in_rom(bytes_to_find):
-    # https://stackoverflow.com/questions/10106901/elegant-find-sub-list-in-list
-    pattern = bytearray(bytes_to_find)
-    mylist = rom.rom_contents
-    for i in range(len(mylist)):
-        if mylist[i] == pattern[0] and mylist[i:i+len(pattern)] == pattern:
-            return i
-    return -1
+    return rom.find(bytes(bytes_to_find))
 
 def find_ptr_in_rom(pointing_addr, search_for_all=None):
-
-    ptrs_addr = []
-    for addr in range(0, rom.rom_size, 4):
-        if is_ptr(addr) and ptr_to_addr(addr) == pointing_addr:
-            if search_for_all is None:
-                return addr
-            else:
-                ptrs_addr += [addr]
-
+    # Looks up the word aligned pointers to pointing_addr in the index
     if search_for_all:
-        return ptrs_addr
-    else:
+        return pointers.pointers_to(pointing_addr)
+
+    addr = pointers.first_pointer_to(pointing_addr)
+    if addr is None:
         return 0
+    return addr
 
 def fill_with_data(addr, num_of_bytes, write_data):
     # If write_data is < 0, then a random number is selected (where 0<= write_data <= 254)
@@ -220,25 +117,32 @@ def fill_with_data(addr, num_of_bytes, write_data):
         write_data = randint(0x1, 0xE)
         write_data += write_data * 16
 
-    rom.seek(addr)
-    for i in range(1, num_of_bytes + 1):
-        rom.write_byte(write_data)
+    if num_of_bytes <= 0:
+        return
+    rom.write_slice(addr, bytes([write_data]) * num_of_bytes)
     rom.flush()
 
 def copy_data(addr_to_copy_from, addr_to_copy_to, num_of_bytes):
-    copied_bytes = []
-    rom.seek(addr_to_copy_from)
-    for i in range(0, num_of_bytes):
-        # Read the byte to write
-        copied_bytes.append(rom.read_byte())
+    copy_data_batch([(addr_to_copy_from, addr_to_copy_to, num_of_bytes)])
 
-    rom.seek(addr_to_copy_to)
-    for i in range(0, num_of_bytes):
-        rom.write_byte(copied_bytes[i])
+def copy_data_batch(ops):
+    # ops: [(src, dst, num_of_bytes)]. All the sources are read before
+    # anything is written, so the ops can overlap (memmove)
+    data = [(dst, rom.read_slice(src, num)) for src, dst, num in ops if num > 0]
+    for dst, chunk in data:
+        rom.write_slice(dst, chunk)
 
 def move_data(addr_to_copy, addr_to_write, num_of_bytes, write_byte=0xff):
-    copy_data(addr_to_copy, addr_to_write, num_of_bytes)
-    fill_with_data(addr_to_copy, num_of_bytes, write_byte)
+    move_data_batch([(addr_to_copy, addr_to_write, num_of_bytes)], write_byte)
+
+def move_data_batch(ops, write_byte=0xff):
+    # Like copy_data_batch, but the sources are filled with write_byte
+    # (except where a destination landed on them)
+    data = [(dst, rom.read_slice(src, num)) for src, dst, num in ops if num > 0]
+    for src, dst, num in ops:
+        fill_with_data(src, num, write_byte)
+    for dst, chunk in data:
+        rom.write_slice(dst, chunk)
 
 def capitalized_hex(addr):
     string = hex(addr)
@@ -0,0 +1,155 @@
+"""
+Structural scanner for 'Open and Analyze'. The byte signatures of the
+OW data, frames pointers and palette entries are searched over the whole
+ROM with regexes (which run in C), then they are chained through the
+pointer index. Only the few addresses that survive have to go through
+the exact predicates (is_jpan_ptr, is_orig_table_ptr, is_palette_ptr).
+
+Pointers are looked up in the pointer index, which only holds word
+aligned pointers, just like the GBA's ldr needs them.
+
+Big ROMs are split in overlapping chunks that are scanned by a process
+pool. The ROM is copied once to shared memory, so it isn't pickled to
+every worker, and the results are merged in chunk order
+"""
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from core_files.rom_api import rom, pointers
+from core_files.scan_worker import scan_signatures, scan_shared_chunk
+
+# Processes used for the analysis, 1 disables the pool
+ANALYSIS_WORKERS = os.cpu_count() or 1
+# Smaller ROMs aren't worth starting the processes. Measured: starting the
+# spawned workers costs ~0.2s, the signatures take ~0.04s/MB and the pointer
+# words ~0.02s/MB, so the pool pays off from ~5-8MB for the whole scan and
+# from ~13-16MB for the pointer words alone (2-4 workers)
+PARALLEL_MIN_SIZE = 0x800000
+PARALLEL_POINTERS_MIN_SIZE = 0x1000000
+CHUNKS_PER_WORKER = 4
+
+
+def table_ptr_candidates(signatures):
+    # Returns the addresses that might pass is_jpan_ptr and is_orig_table_ptr
+    ow_data = set(signatures["ow_data"])
+    frames_ptrs = set(signatures["frames_ptrs"])
+
+    # Original tables: ptr -> Table entry -> OW Data -> Frames Pointers
+    orig_tables = set()
+    data_ptrs = set()
+    for data_addr in ow_data:
+        entries = pointers.pointers_to(data_addr)
+        data_ptrs.update(entries)
+        try:
+            if rom.read_ptr(data_addr + 0x1C) not in frames_ptrs:
+                continue
+        except IndexError:
+            continue
+        for entry in entries:
+            orig_tables.update(pointers.pointers_to(entry))
+
+    # OWM's tables: ptr -> Table with 3 pointers right after its 256 entries
+    owm_tables = set()
+    for end_of_table in signatures["table_ends"]:
+        table = end_of_table - 256 * 4
+        if table < 0:
+            continue
+        if table not in data_ptrs:
+            try:
+                if rom.read_u32(table) != 0x11111111:
+                    continue
+            except IndexError:
+                continue
+        owm_tables.update(pointers.pointers_to(table))
+
+    # JPAN: a ptr to Table 0, whose entries are table pointers
+    jpan = set()
+    for table_ptr in orig_tables | owm_tables:
+        jpan.update(pointers.pointers_to(table_ptr))
+
+    return sorted(jpan), sorted(orig_tables)
+
+
+def palette_ptr_candidates(signatures):
+    # Returns the addresses that might point to a palette table
+    candidates = set()
+    for palette_entry in signatures["palettes"]:
+        candidates.update(pointers.pointers_to(palette_entry))
+    return sorted(candidates)
+
+
+def split_in_chunks(size, num):
+    # Word aligned [start, end) chunks, the workers read past the end
+    chunk = max(size // num, 1)
+    chunk += -chunk % 4
+    return [(start, min(start + chunk, size)) for start in range(0, size, chunk)]
+
+
+def parallel_scan(buf, workers, signatures=True):
+    from multiprocessing import shared_memory
+
+    size = len(buf)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        shm.buf[:size] = buf
+        chunks = split_in_chunks(size, workers * CHUNKS_PER_WORKER)
+        # Don't fork the app, its threads (the thumbnails) might hold locks
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            results = list(pool.map(scan_shared_chunk,
+                                    [shm.name] * len(chunks), [size] * len(chunks),
+                                    [start for start, end in chunks],
+                                    [end for start, end in chunks],
+                                    [signatures] * len(chunks)))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    merged = {}
+    for result in results:
+        for key, found in result.items():
+            merged.setdefault(key, []).extend(found)
+    return merged
+
+
+def scan_all(buf, workers):
+    # Signatures and pointer words of the whole ROM
+    if workers > 1 and len(buf) >= PARALLEL_MIN_SIZE:
+        try:
+            return parallel_scan(buf, workers)
+        except (OSError, ImportError, BrokenProcessPool) as e:
+            print("rom_scanner: parallel scan failed, scanning serially ({})".format(e))
+
+    result = scan_signatures(buf)
+    result["pointers"] = None
+    return result
+
+
+def scan_rom(workers=None):
+    if workers is None:
+        workers = ANALYSIS_WORKERS
+
+    signatures = scan_all(rom.buffer(), workers)
+    # The pointer words came for free with the parallel scan
+    packed = signatures.pop("pointers")
+    if packed is not None:
+        pointers.build(packed)
+    return signatures
+
+
+def index_pointers(workers=None):
+    # Builds the pointer index, with the process pool for big ROMs
+    if workers is None:
+        workers = ANALYSIS_WORKERS
+    if pointers.built:
+        return
+
+    buf = rom.buffer()
+    if workers > 1 and len(buf) >= PARALLEL_POINTERS_MIN_SIZE:
+        try:
+            pointers.build(parallel_scan(buf, workers, False)["pointers"])
+            return
+        except (OSError, ImportError, BrokenProcessPool) as e:
+            print("rom_scanner: parallel scan failed, scanning serially ({})".format(e))
+    pointers.sync()
@@ -0,0 +1,68 @@
+"""
+What the analysis workers run: the signature regexes and the scan of a
+chunk of the ROM in shared memory. The workers start from a fresh
+interpreter and import only this module (and what it needs), so keep
+the GUI and the ROM state out of it
+"""
+import re
+from core_files.core import frametype1, frametype2, frametype3, frametype4, \
+    frametype5, frametype6, frametype7, frametype8
+from core_files.pointer_index import find_ptr_words, pack_ptr_words
+
+FRAME_TYPES = [frametype1, frametype2, frametype3, frametype4,
+               frametype5, frametype6, frametype7, frametype8]
+
+# Bytes 0-1 are 0xFF and the words at 0x10-0x20 are pointers
+OW_DATA_SIG = re.compile(b"\xff(?=\xff.{17}[\x08\x09].{3}[\x08\x09].{3}[\x08\x09]"
+                         b".{3}[\x08\x09].{3}[\x08\x09])", re.DOTALL)
+# A pointer followed by the two bytes of a frame type
+FRAMES_PTR_SIG = re.compile(b"[\x08\x09](?=" + b"|".join(
+    re.escape(bytes(frame_type)) for frame_type in FRAME_TYPES) + b")")
+# A pointer, the palette id and the 0x11 0x00 0x00 tail
+PALETTE_SIG = re.compile(b"(?<=[\x08\x09].)\x11\x00\x00", re.DOTALL)
+# Three pointers in a row, OWM's signature at the end of a table
+TABLE_END_SIG = re.compile(b"[\x08\x09](?=.{3}[\x08\x09].{3}[\x08\x09])", re.DOTALL)
+
+# The longest signature, chunks need to overlap by this much
+SIG_LENGTH = 0x24
+
+
+def scan_signatures(buf, start=0, end=None):
+    # Addresses in [start, end) where the signatures begin
+    if end is None:
+        end = len(buf)
+    stop = min(end + SIG_LENGTH, len(buf))
+    view = memoryview(buf)[start:stop]
+    limit = end - start
+
+    def starts(pattern, offset):
+        found = []
+        for match in pattern.finditer(view):
+            addr = match.start() - offset
+            if 0 <= addr < limit:
+                found.append(start + addr)
+        return found
+
+    return {
+        "ow_data": starts(OW_DATA_SIG, 0),
+        "frames_ptrs": starts(FRAMES_PTR_SIG, 3),
+        "palettes": starts(PALETTE_SIG, 5),
+        "table_ends": starts(TABLE_END_SIG, 3),
+    }
+
+
+def scan_shared_chunk(shm_name, size, start, end, signatures):
+    # Runs in the workers, they share the resource tracker of the app
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    buf = shm.buf[:size]
+    try:
+        result = {}
+        if signatures:
+            result = scan_signatures(buf, start, end)
+        # As arrays, a list of tuples would cost more to pickle than to scan
+        result["pointers"] = [pack_ptr_words(find_ptr_words(buf, start, end))]
+    finally:
+        buf.release()
+        shm.close()
+    return result
@@ -0,0 +1,155 @@
+"""
+Index of every frame of every OW by its hash, to find where a sprite
+already is in the ROM. There are two hashes per frame: the exact one
+(shape and colors) and a palette independent one, where the colors are
+renumbered by their first appearance so recolors match too.
+
+The hashes of an OW are cached until its frames or its palette are
+written, so only the OWs that changed are hashed again. The maps are only
+rebuilt after a write or once the tables were read again
+"""
+import hashlib
+from PIL import Image
+from core_files import ImageEditor
+from core_files.ImageEditor import tiles_to_linear, unpack_pixels, get_frame_dimensions, \
+    get_frame_size, get_ow_palette_id, get_palette, ptr_to_addr, rom
+from core_files.range_cache import RangeCache
+
+# Number of OWs whose hashes are kept
+SPRITE_HASH_ENTRIES = 0x10000
+
+
+def canonical_pixels(pixels):
+    # Renumbers the colors by their first appearance
+    pixels = bytes(pixels)
+    order = sorted(set(pixels), key=pixels.index)
+    table = bytearray(range(256))
+    for i, color in enumerate(order):
+        table[color] = i
+    return pixels.translate(table), order
+
+
+def frame_hashes(pixels, palette, width, height):
+    # Returns the (exact, palette independent) hashes of a frame
+    shape, order = canonical_pixels(pixels)
+    head = width.to_bytes(2, "little") + height.to_bytes(2, "little")
+
+    colors = bytearray()
+    for color in order:
+        rgb = palette[color * 3:color * 3 + 3]
+        # The GBA only has 5 bits per channel
+        colors += bytes(channel & 0xF8 for channel in rgb) + bytes(3 - len(rgb))
+
+    exact = hashlib.blake2b(head + shape + colors, digest_size=16).digest()
+    loose = hashlib.blake2b(head + shape, digest_size=16).digest()
+    return exact, loose
+
+
+class SpriteIndex:
+    def __init__(self, game):
+        # (frames_addr, ow_type, frames_num, palette_addr) -> hashes of the frames
+        self.hashes = RangeCache(game, SPRITE_HASH_ENTRIES)
+        # The tables list and the palette table the maps were built from
+        self.tables_list = None
+        self.palette_table_addr = None
+        self.stale = True
+        # hash -> [(table_id, ow_id, frame)]
+        self.exact = {}
+        self.loose = {}
+
+        game.add_listener(self)
+
+    # Game listener
+    def reset(self):
+        self.stale = True
+
+    def touch(self, start, end):
+        self.stale = True
+
+    def ow_hashes(self, manager, ow):
+        frames = ow.frames
+        ow_type = frames.get_type()
+        if ow_type == -1:
+            return None, []
+        frames_num = frames.get_num()
+        palette_addr = manager.get_palette_addr(get_ow_palette_id(ow.ow_data_addr))
+
+        key = (frames.frames_addr, ow_type, frames_num, palette_addr)
+        hashes = self.hashes.get(key)
+        if hashes is not None:
+            return key, hashes
+
+        width, height = get_frame_dimensions(ow_type)
+        size = get_frame_size(ow_type)
+        data = rom.read_slice(frames.frames_addr, frames_num * size)
+        palette = []
+        colors_addr = 0
+        if palette_addr != 0:
+            palette = get_palette(palette_addr)
+            colors_addr = ptr_to_addr(palette_addr)
+
+        hashes = [frame_hashes(unpack_pixels(tiles_to_linear(data[i * size:(i + 1) * size], width, height)),
+                               palette, width, height) for i in range(0, frames_num)]
+        self.hashes.put(key, hashes, [(frames.frames_addr, frames.frames_addr + len(data)),
+                                      (palette_addr, palette_addr + 4),
+                                      (colors_addr, colors_addr + 32)], 1)
+        return key, hashes
+
+    def sync(self, manager):
+        # resetRoot gives the root a new tables list
+        tables_list = ImageEditor.root.tables_list
+        if not self.stale and self.tables_list is tables_list and self.palette_table_addr == manager.table_addr:
+            return
+
+        # One pass over the OWs, only the changed ones are hashed
+        self.exact = {}
+        self.loose = {}
+        for table_id, table in enumerate(tables_list):
+            for ow_id, ow in enumerate(table.ow_data_ptrs):
+                key, hashes = self.ow_hashes(manager, ow)
+                for frame, (exact, loose) in enumerate(hashes):
+                    self.exact.setdefault(exact, []).append((table_id, ow_id, frame))
+                    self.loose.setdefault(loose, []).append((table_id, ow_id, frame))
+        self.tables_list = tables_list
+        self.palette_table_addr = manager.table_addr
+        self.stale = False
+
+    def find_frame(self, manager, pixels, palette, width, height, exact=True):
+        # pixels: palette indexes, one byte per pixel. Returns [(table_id, ow_id, frame)]
+        self.sync(manager)
+        exact_hash, loose_hash = frame_hashes(pixels, palette, width, height)
+        if exact:
+            return list(self.exact.get(exact_hash, ()))
+        return list(self.loose.get(loose_hash, ()))
+
+    def find_ow(self, manager, table_id, ow_id, exact=True):
+        # The frames of other OWs that match any frame of this one
+        self.sync(manager)
+        ow = ImageEditor.root.tables_list[table_id].ow_data_ptrs[ow_id]
+        key, hashes = self.ow_hashes(manager, ow)
+        found = set()
+        for exact_hash, loose_hash in hashes:
+            if exact:
+                found.update(self.exact.get(exact_hash, ()))
+            else:
+                found.update(self.loose.get(loose_hash, ()))
+        return sorted(location for location in found if location[:2] != (table_id, ow_id))
+
+    def find_image(self, manager, image, exact=True):
+        # image: a frame or a row of frames of any of the OW sizes
+        if image.getpalette() is None:
+            image = image.convert('P', palette=Image.ADAPTIVE, colors=16)
+        palette = image.getpalette()
+
+        found = set()
+        for ow_type in range(1, 9):
+            width, height = get_frame_dimensions(ow_type)
+            if image.height != height or image.width % width != 0:
+                continue
+            for column in range(0, image.width, width):
+                frame = image.crop((column, 0, column + width, height))
+                found.update(self.find_frame(manager, frame.tobytes(), palette, width, height, exact))
+        return sorted(found)
+
+
+sprite_index = SpriteIndex(rom)
@@ -0,0 +1,82 @@
+"""
+On-disk cache of the thumbnails of the tree, keyed by a hash of the bytes
+of the frame and of its palette. The key is the content itself, so it
+holds across ROMs and profiles and an edited frame just misses it.
+
+The thumbnails are stored decoded (1 byte per pixel and the palette), so
+the tree can show them without going through the thumbnail pool
+"""
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+# Not in the analysis cache directory, that one is pruned by age
+THUMBNAIL_PATH = "Files/Thumbnails/thumbnails.pkl"
+# Number of thumbnails kept on disk, the least recently used go first
+MAX_THUMBNAILS = 0x4000
+THUMBNAIL_VERSION = 1
+
+
+def thumbnail_key(data, palette):
+    # data: the 4bpp tiles of the frame, palette: [r, g, b, r, g, b, ...]
+    digest = hashlib.blake2b(bytes(data), digest_size=16)
+    digest.update(bytes(palette))
+    return digest.digest()
+
+
+class ThumbnailCache:
+    def __init__(self, path=THUMBNAIL_PATH, max_entries=MAX_THUMBNAILS):
+        self.path = path
+        self.max_entries = max_entries
+        # key -> (width, height, pixels, palette), the oldest first
+        self.entries = OrderedDict()
+        self.modified = False
+        self.loaded = False
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        try:
+            with open(self.path, "rb") as f:
+                version, entries = pickle.load(f)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return
+        if version != THUMBNAIL_VERSION:
+            return
+        self.entries.update(entries)
+        self.evict()
+
+    def get(self, key):
+        self.load()
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, width, height, pixels, palette):
+        self.load()
+        self.entries[key] = (width, height, bytes(pixels), bytes(palette))
+        self.entries.move_to_end(key)
+        self.modified = True
+        self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        if not self.modified:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "wb") as f:
+                pickle.dump((THUMBNAIL_VERSION, self.entries), f)
+            self.modified = False
+        except OSError as e:
+            print("thumbnail_cache: Couldn't save the cache ({})".format(e))
+
+
+thumbnail_cache = ThumbnailCache()
@@ -5,6 +5,9 @@ from PyQt5.QtWidgets import QAbstractItemView
 from ui_functions.graphics_class import ImageItem
 from ui_functions.supportWindows import *
 from ui_functions.ui_updater import *
+from core_files.thumbnail_cache import thumbnail_cache
+from core_files.ImageEditor import set_frame_dedup
+from core_files.rom_scanner import scan_rom, table_ptr_candidates, palette_ptr_candidates
 from pprint import pprint
 import os, sys, shutil
 
@@ -32,6 +35,10 @@ class MyApp(base, form):
         self.OWTreeView.setSelectionMode(QAbstractItemView.ExtendedSelection)
         self.tree_selection_model = self.OWTreeView.selectionModel()
         self.tree_selection_model.currentChanged.connect(self.item_selected)
+        # Thumbnails of the rows scrolled out of view aren't rendered
+        self.OWTreeView.verticalScrollBar().valueChanged.connect(
+            lambda: self.tree_model.cancelHiddenThumbnails(self.OWTreeView))
+        self.OWTreeView.collapsed.connect(lambda: self.tree_model.cancelHiddenThumbnails(self.OWTreeView))
 
         # Graphics Viewer
         self.ow_graphics_scene = QtWidgets.QGraphicsScene()
@@ -67,11 +74,15 @@ class MyApp(base, form):
         self.actionImport_OW.triggered.connect(lambda: menu_buttons_functions.import_ow_sprsrc(self))
         self.actionImport_Pokemon.triggered.connect(lambda: menu_buttons_functions.import_pokemon_sprsrc(self))
         self.actionPaletteCleanup.triggered.connect(lambda: menu_buttons_functions.palette_cleanup(self))
+        self.actionFind_OW_Duplicates.triggered.connect(lambda: menu_buttons_functions.find_ow_duplicates(self))
+        self.actionFind_Image.triggered.connect(lambda: menu_buttons_functions.find_image(self))
+        self.actionShare_Identical_Frames.toggled.connect(self.frame_dedup_toggled)
 
         # micro patches, fix the header sizes
         self.OWTreeView.resizeColumnToContents(1)
         self.OWTreeView.resizeColumnToContents(2)
         self.initPaths()
+        self.actionShare_Identical_Frames.setChecked(self.paths.get('FRAME_DEDUP', False))
         initBar(self.statusbar)
 
     def open_rom(self, fn=None):
@@ -94,7 +105,7 @@ class MyApp(base, form):
         if self.rom_info.rom_successfully_loaded == 1:
             resetRoot()
 
-            self.sprite_manager = ImageManager()
+            self.sprite_manager = new_sprite_manager()
             self.statusbar.showMessage("Ready")
 
             self.selected_table = None
@@ -107,6 +118,8 @@ class MyApp(base, form):
             self.initPaletteIdComboBox()
             self.initProfileComboBox()
             self.initPaletteSlotComboBox()
+            analysis_cache.save()
+            thumbnail_cache.save()
         else:
             self.statusbar.showMessage("Couldn't find a Profile in the INI for your ROM. Open it with 'Open and Analyze ROM'.")
 
@@ -135,7 +148,12 @@ class MyApp(base, form):
             name += str(i)
         self.rom_info.name = name
 
-        create_profile(name, *self.find_rom_offsets())
+        # The offsets of an unchanged ROM are in the cache
+        offsets = analysis_cache.get("offsets")
+        if offsets is None:
+            offsets = self.find_rom_offsets()
+            analysis_cache.put("offsets", offsets)
+        create_profile(name, *offsets)
 
         self.rom_info.set_info(get_name_line_index(name))
         self.create_templates(ptr_to_addr(self.rom_info.ow_table_ptr))
@@ -147,21 +165,30 @@ class MyApp(base, form):
         self.romNameLabel.setText(rom.rom_path.split('/')[-1])
 
     def find_rom_offsets(self):
+        # The scanner leaves only a few candidates for the exact checks
+        self.statusbar.showMessage("Scanning the ROM")
+        signatures = scan_rom()
+
         # Find OW Offsets
         self.statusbar.showMessage("Searching for OW Offsets")
-        for addr in range(0, rom.rom_size, 4):
+        jpan_ptrs, orig_table_ptrs = table_ptr_candidates(signatures)
+        for addr in jpan_ptrs:
             if is_jpan_ptr(addr):
                 table_ptrs = ptr_to_addr(addr)
                 break
-            elif is_orig_table_ptr(addr):
-                table_ptrs = addr
+        else:
+            # Without JPAN's patch the last Table found is used
+            for addr in reversed(orig_table_ptrs):
+                if is_orig_table_ptr(addr):
+                    table_ptrs = addr
+                    break
 
         print(HEX(table_ptrs))
         ow_ptrs_addr = ptr_to_addr(table_ptrs)
 
         # Find Palette Offsets
         self.statusbar.showMessage("Searching for Palette Offsets")
-        for addr in range(0, rom.rom_size, 4):
+        for addr in palette_ptr_candidates(signatures):
             # Search for the first Palette Pointer
             if (is_ptr(addr) and is_palette_ptr(ptr_to_addr(addr))):
                 palette_table = ptr_to_addr(addr)
@@ -181,7 +208,7 @@ class MyApp(base, form):
             resetRoot()
 
             self.statusbar.showMessage("Done")
-            self.sprite_manager = ImageManager()
+            self.sprite_manager = new_sprite_manager()
 
             self.selected_table = None
             self.selected_ow = None
@@ -193,30 +220,19 @@ class MyApp(base, form):
             self.initFootprintComboBox()
             self.initPaletteIdComboBox()
             self.initPaletteSlotComboBox()
+            analysis_cache.save()
+            thumbnail_cache.save()
 
     def save_rom(self, fn=rom.rom_path):
         ''' The file might have changed while we were editing, so
-                we reload it and apply the modifications to it. '''
+                only the modified ranges are written back to it. '''
         self.statusbar.showMessage("Saving...")
         if not rom.rom_file_name:
             QtWidgets.QMessageBox.critical(self, "ERROR!", "No ROM loaded!")
             return
-        try:
-            with open(rom.rom_file_name, "rb") as rom_file:
-                actual_rom_contents = bytearray(rom_file.read())
-        except FileNotFoundError:
-            with open(rom.rom_file_name, "wb") as rom_file:
-                rom_file.write(rom.rom_contents)
-            return
 
         self.statusbar.showMessage("Saving... Writing...")
-
-        for i in range(len(rom.rom_contents)):
-            if rom.rom_contents[i] != rom.original_rom_contents[i]:
-                actual_rom_contents[i] = rom.rom_contents[i]
-
-        with open(fn, "wb+") as rom_file:
-            rom_file.write(actual_rom_contents)
+        rom.save(fn or rom.rom_file_name)
 
         self.statusbar.showMessage("Saved {}".format(rom.rom_file_name))
         self.romNameLabel.setText(rom.rom_file_name.split('/')[-1])
@@ -399,13 +415,13 @@ class MyApp(base, form):
         if node.typeInfo() == "ow_node":
             self.selected_table = node.parent().getId()
             self.selected_ow = node.getId()
-            self.paint_graphics_view(node.image)
+            self.paint_graphics_view(node.getImage())
 
             # Update the SpinBox/SliderBox
-            self.framesSpinBox.setRange(0, node.frames - 1)
+            self.framesSpinBox.setRange(0, node.getFrames() - 1)
             self.framesSpinBox.setValue(0)
             self.framesSpinSlider.setMinimum(0)
-            self.framesSpinSlider.setMaximum(node.frames - 1)
+            self.framesSpinSlider.setMaximum(node.getFrames() - 1)
             self.framesSpinSlider.setValue(0)
         else:
             self.selected_table = node.getId()
@@ -503,8 +519,15 @@ class MyApp(base, form):
             with open("Files/paths.pkl", 'wb') as f:
                 pickle.dump(self.paths, f)
 
+    def frame_dedup_toggled(self, checked):
+        set_frame_dedup(checked)
+        # Kept with the paths, so it's remembered
+        self.paths['FRAME_DEDUP'] = checked
+
     def exit_app(self):
         import pickle
+        analysis_cache.save()
+        thumbnail_cache.save()
 
         with open("Files/paths.pkl", 'wb') as f:
             pickle.dump(self.paths, f)
@@ -2,6 +2,10 @@ import sys, os
 from PyQt5 import QtWidgets, QtCore
 from core_files.ImageEditor import *
 from ui_functions.supportWindows import *
+from core_files.sprite_index import sprite_index
+
+# Matches listed in the message box of the sprite searches
+MAX_LISTED_MATCHES = 20
 
 
 # Menu Functions
@@ -11,7 +15,7 @@ def export_ow_image(ui):
     # For the Palette
     palette_id = get_ow_palette_id(root.tables_list[ui.selected_table].ow_data_ptrs[ui.selected_ow].ow_data_addr)
     palette_addr = ui.sprite_manager.get_palette_addr(palette_id)
-    sprite_palette = create_palette_from_gba(ptr_to_addr(palette_addr))
+    sprite_palette = get_palette(palette_addr)
     image.putpalette(sprite_palette)
 
     name = '/' + str(ui.selected_table) + '_' + str(ui.selected_ow)
@@ -103,6 +107,51 @@ def palette_cleanup(ui):
 def remove_table(ui):
     ui.tree_model.removeTable(ui.selected_table, ui)
 
+def show_sprite_matches(ui, title, found, recolored):
+    if not found:
+        QtWidgets.QMessageBox.information(ui, title, "No matching frames were found.")
+        return
+
+    message = "Found {} matching frames".format(len(found))
+    if recolored:
+        message += " with a different palette"
+    message += ":\n"
+    for table_id, ow_id, frame in found[:MAX_LISTED_MATCHES]:
+        message += "\nTable[{}] : OW[{}] : Frame {}".format(table_id, ow_id, frame)
+    if len(found) > MAX_LISTED_MATCHES:
+        message += "\n..."
+    QtWidgets.QMessageBox.information(ui, title, message)
+
+    # Select the first match
+    table_id, ow_id, frame = found[0]
+    tableNode = ui.tree_model.index(table_id, 0, QtCore.QModelIndex())
+    ui.tree_model.fetchAll(tableNode)
+    ui.OWTreeView.setCurrentIndex(ui.tree_model.index(ow_id, 0, tableNode))
+
+def find_ow_duplicates(ui):
+    # Frames of other OWs identical to the ones of the selected OW, else recolors of them
+    found = sprite_index.find_ow(ui.sprite_manager, ui.selected_table, ui.selected_ow)
+    recolored = not found
+    if recolored:
+        found = sprite_index.find_ow(ui.sprite_manager, ui.selected_table, ui.selected_ow, exact=False)
+    show_sprite_matches(ui, "Duplicates of Table[{}] : OW[{}]".format(ui.selected_table, ui.selected_ow),
+                        found, recolored)
+
+def find_image(ui):
+    dlg = QtWidgets.QFileDialog()
+    image_loc, _ = dlg.getOpenFileName(dlg, 'Open Image file', ui.paths['IMP_FRMS_PATH'], "PNG Files (*.png);;"
+                                                                                       "BMP Files (*.bmp)")
+    if not image_loc:
+        return
+    ui.paths['IMP_FRMS_PATH'] = os.path.dirname(os.path.realpath(image_loc))
+
+    image = Image.open(image_loc)
+    found = sprite_index.find_image(ui.sprite_manager, image)
+    recolored = not found
+    if recolored:
+        found = sprite_index.find_image(ui.sprite_manager, image, exact=False)
+    show_sprite_matches(ui, "Frames of " + os.path.basename(image_loc), found, recolored)
+
 # Buttons Functions
 def addOWButtonFunction(ui):
 
@@ -0,0 +1,99 @@
+from PyQt5 import QtCore, QtGui
+from core_files.ImageEditor import tiles_to_linear, unpack_pixels
+from core_files.thumbnail_cache import thumbnail_cache
+
+# Renders the thumbnails of the tree in worker threads. A job gets a copy of
+# the bytes of the frame and of the palette, so the workers never read the ROM.
+# The latest requests (the rows being painted right now) run first. The
+# rendered pixels go to the thumbnail cache under the hash of the content
+
+
+def indexed_image(width, height, pixels, palette):
+    # pixels: 1 byte per pixel, palette: [r, g, b, r, g, b, ...]
+    image = QtGui.QImage(bytes(pixels), width, height, width, QtGui.QImage.Format_Indexed8).copy()
+    palette = bytes(palette) + bytes(max(0, 48 - len(palette)))
+    image.setColorTable([QtGui.qRgb(palette[i], palette[i + 1], palette[i + 2])
+                         for i in range(0, len(palette) - 2, 3)])
+    return image
+
+
+class ThumbnailJob(QtCore.QRunnable):
+    def __init__(self, pool, key, data, palette, width, height, content_key):
+        super(ThumbnailJob, self).__init__()
+        # The pool keeps the job alive, not Qt
+        self.setAutoDelete(False)
+        self.pool = pool
+        self.key = key
+        self.data = bytes(data)
+        self.palette = list(palette)
+        self.width = width
+        self.height = height
+        self.content_key = content_key
+        self.cancelled = False
+
+    def run(self):
+        if self.cancelled:
+            self.pool.jobDone.emit(self.key, QtGui.QImage(), b"")
+            return
+        pixels = bytes(unpack_pixels(tiles_to_linear(self.data, self.width, self.height)))
+        self.pool.jobDone.emit(self.key, indexed_image(self.width, self.height, pixels, self.palette), pixels)
+
+
+class ThumbnailPool(QtCore.QObject):
+    # key, QImage. Emitted in the GUI thread
+    ready = QtCore.pyqtSignal(object, QtGui.QImage)
+    # key, QImage, pixels. Emitted by the workers
+    jobDone = QtCore.pyqtSignal(object, QtGui.QImage, bytes)
+
+    def __init__(self, parent=None):
+        super(ThumbnailPool, self).__init__(parent)
+        self.pool = QtCore.QThreadPool(self)
+        # key -> job, until the job is done or taken back from the queue
+        self.jobs = {}
+        self.priority = 0
+
+        self.jobDone.connect(self.finished, QtCore.Qt.QueuedConnection)
+
+    def request(self, key, data, palette, width, height, content_key):
+        job = self.jobs.get(key)
+        if job is not None:
+            job.cancelled = False
+            return
+
+        job = ThumbnailJob(self, key, data, palette, width, height, content_key)
+        self.jobs[key] = job
+        self.priority += 1
+        self.pool.start(job, self.priority)
+
+    def isPending(self, key):
+        job = self.jobs.get(key)
+        return job is not None and not job.cancelled
+
+    def cancel(self, key):
+        job = self.jobs.get(key)
+        if job is None:
+            return
+        job.cancelled = True
+        # A running job is dropped when it finishes
+        if self.pool.tryTake(job):
+            del self.jobs[key]
+
+    def retain(self, keep):
+        # Cancels the jobs whose key doesn't pass keep(key)
+        for key in list(self.jobs):
+            if not keep(key):
+                self.cancel(key)
+
+    def clear(self):
+        self.retain(lambda key: False)
+
+    def finished(self, key, image, pixels):
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return
+        if pixels:
+            # Even a cancelled job saves the next one the work
+            thumbnail_cache.put(job.content_key, job.width, job.height, pixels, job.palette)
+        if job.cancelled:
+            return
+        self.ready.emit(key, image)
@@ -1,10 +1,14 @@
 from PyQt5 import QtCore, QtGui
 from ui_functions.RomInfo import *
-from PIL.ImageQt import ImageQt
+from ui_functions.thumbnail_pool import ThumbnailPool, indexed_image
+from core_files.thumbnail_cache import thumbnail_cache, thumbnail_key
 
 # the root is defined in ImageEditor.py
 # the rom is defined in the rom_api.py
 
+# OW nodes created per fetchMore
+FETCH_BATCH = 64
+
 
 class Node(object):
     def __init__(self, id, parent=None):
@@ -13,6 +17,8 @@ class Node(object):
         self.name = ""
         self._children = []
         self._parent = parent
+        # Kept up to date by the parent, so row() doesn't search the list
+        self._row = None
         self.image = None
 
         if parent is not None:
@@ -22,27 +28,46 @@ class Node(object):
         return "NODE"
 
     def addChild(self, child):
+        child._row = len(self._children)
         self._children.append(child)
 
     def insertChild(self, position, child):
+        return self.insertChildren(position, [child])
+
+    def insertChildren(self, position, children):
 
         if position < 0 or position > len(self._children):
             return False
 
-        self._children.insert(position, child)
-        child._parent = self
+        self._children[position:position] = children
+        for child in children:
+            child._parent = self
+        self.renumber(position)
         return True
 
     def removeChild(self, position):
+        return self.removeChildren(position, 1)
 
-        if position < 0 or position > len(self._children):
+    def removeChildren(self, position, count):
+
+        if position < 0 or position + count > len(self._children):
             return False
 
-        child = self._children.pop(position)
-        child._parent = None
+        for child in self._children[position:position + count]:
+            child._parent = None
+            child._row = None
+        del self._children[position:position + count]
+        self.renumber(position)
 
         return True
 
+    def renumber(self, position):
+        # The tables and the OWs are named after their row
+        for row in range(position, len(self._children)):
+            child = self._children[row]
+            child._row = row
+            child._id = row
+
     def setName(self, name):
         self._name = name
 
@@ -57,7 +82,7 @@ class Node(object):
 
     def row(self):
         if self._parent is not None:
-            return self._parent._children.index(self)
+            return self._row
 
     def log(self, tabLevel=-1):
 
@@ -100,21 +125,37 @@ class OWNode(Node):
     def __init__(self, id, parent=None):
         super(OWNode, self).__init__(id, parent)
         self.name = "Overworld "
-        self.frames = 0
-
-        if parent is not None:
-            self.setInfo()
+        self.frames = None
+        # QImage of frame 0, rendered by the thumbnail pool
+        self.thumbnail = None
+        # Built once from the thumbnail, the view asks for it on every repaint
+        self.icon = None
+        # Bumped by setInfo, so older thumbnails get dropped
+        self.generation = 0
 
     def typeInfo(self):
         return "ow_node"
 
     def setInfo(self):
-        table_id = self._parent.getId()
-        ow_id = self._id
+        # The OW changed, the frame and the number of frames get read again when shown
+        self.image = None
+        self.frames = None
+        self.thumbnail = None
+        self.icon = None
+        self.generation += 1
 
-        self.image = ImageManager().get_ow_frame(ow_id, table_id, 0)
-        # print("OW: "+str(ow_id))
-        self.frames = root.tables_list[table_id].ow_data_ptrs[ow_id].frames.get_num()
+    def thumbnailKey(self):
+        return self, self.generation
+
+    def getImage(self):
+        if self.image is None:
+            self.image = get_sprite_manager().get_ow_frame(self._id, self._parent.getId(), 0)
+        return self.image
+
+    def getFrames(self):
+        if self.frames is None:
+            self.frames = root.tables_list[self._parent.getId()].ow_data_ptrs[self._id].frames.get_num()
+        return self.frames
 
 
 class TreeViewModel(QtCore.QAbstractItemModel):
@@ -123,15 +164,14 @@ class TreeViewModel(QtCore.QAbstractItemModel):
     def __init__(self, model_root, parent=None):
         super(TreeViewModel, self).__init__(parent)
         self._rootNode = model_root
+        self.thumbnails = ThumbnailPool(self)
+        self.thumbnails.ready.connect(self.thumbnailReady)
+        self.placeholderIcon = QtGui.QIcon()
 
         for table in range(len(root.tables_list)):
-            # add the table nodes
+            # add the table nodes, their OWs are fetched when expanded
             newTableNode = TableNode(table, self._rootNode)
 
-            for ow in range(len(root.tables_list[table].ow_data_ptrs)):
-                # add the ow nodes
-                newOWNode = OWNode(ow, newTableNode)
-
 
     """INPUTS: QModelIndex"""
     """OUTPUT: int"""
@@ -150,6 +190,45 @@ class TreeViewModel(QtCore.QAbstractItemModel):
     def columnCount(self, parent):
         return 3
 
+    """INPUTS: QModelIndex"""
+    """OUTPUT: bool"""
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        node = self.getNode(parent)
+
+        if node.typeInfo() == "table_node":
+            return len(root.tables_list[node.getId()].ow_data_ptrs) != 0
+        if node.typeInfo() == "ow_node":
+            return False
+        return node.childCount() != 0
+
+    def canFetchMore(self, parent):
+        node = self.getNode(parent)
+
+        if node.typeInfo() == "table_node":
+            return node.childCount() < len(root.tables_list[node.getId()].ow_data_ptrs)
+        return False
+
+    def fetchMore(self, parent):
+        node = self.getNode(parent)
+        if node.typeInfo() != "table_node":
+            return
+
+        start = node.childCount()
+        end = min(start + FETCH_BATCH, len(root.tables_list[node.getId()].ow_data_ptrs))
+        if end <= start:
+            return
+
+        self.beginInsertRows(parent, start, end - 1)
+        for ow in range(start, end):
+            OWNode(ow, node)
+        self.endInsertRows()
+
+    def fetchAll(self, parent):
+        # The OWs of a table have to be there before changing them
+        while self.canFetchMore(parent):
+            self.fetchMore(parent)
+
     """INPUTS: QModelIndex, int"""
     """OUTPUT: QVariant, strings are cast to QString which is a QVariant"""
 
@@ -165,7 +244,7 @@ class TreeViewModel(QtCore.QAbstractItemModel):
                 return node.name + str(node.getId())
             elif index.column() == 2:
                 if isinstance(node, OWNode):
-                    return node.frames
+                    return node.getFrames()
 
                 return None
 
@@ -174,7 +253,14 @@ class TreeViewModel(QtCore.QAbstractItemModel):
                 typeInfo = node.typeInfo()
 
                 if typeInfo == "ow_node":
-                    return QtGui.QIcon(QtGui.QPixmap.fromImage(ImageQt(node.image)))
+                    if node.icon is None:
+                        if node.thumbnail is None:
+                            self.requestThumbnail(node)
+                        if node.thumbnail is None:
+                            # Blank until the pool renders it
+                            return self.placeholderIcon
+                        node.icon = QtGui.QIcon(QtGui.QPixmap.fromImage(node.thumbnail))
+                    return node.icon
 
     """INPUTS: QModelIndex, QVariant, int (flag)"""
 
@@ -189,7 +275,9 @@ class TreeViewModel(QtCore.QAbstractItemModel):
                 if value is not None:
                     node.setId(value)
                 else:
+                    self.thumbnails.cancel(node.thumbnailKey())
                     node.setInfo()
+                    self.dataChanged.emit(index.sibling(index.row(), 0), index.sibling(index.row(), 2))
 
             # For the Tables
             if node.typeInfo() == "table_node":
@@ -265,29 +353,26 @@ class TreeViewModel(QtCore.QAbstractItemModel):
     def insertRows(self, position, rows, parent=QtCore.QModelIndex()):
 
         parentNode = self.getNode(parent)
-
-        self.beginInsertRows(parent, position, position + rows - 1)
         childCount = parentNode.childCount()
+        if rows <= 0:
+            return False
+        if position < 0 or parentNode.typeInfo() == "NODE":
+            # The new tables go after the last one
+            position = childCount
 
-        for row in range(rows):
-
-            if parentNode.typeInfo() == "table_node":
-                # Adding OWs
-                childNode = OWNode(position + row)
-                success = parentNode.insertChild(position + row, childNode)
-                # Re-init the node, so it loads the frame
-                self.setData(self.index(row + position, 0, parent), None)
-            if parentNode.typeInfo() == "NODE":
-                childNode = TableNode(childCount)
-                success = parentNode.insertChild(childCount, childNode)
-
-        # Only for the OWs, increase the name Id by one, in case an OW was INSERTED
         if parentNode.typeInfo() == "table_node":
-            for row in range(position + rows, childCount + rows):
-                self.setData(self.index(row, 0, parent), row)
+            # Adding OWs, the node loads the frame when it gets shown
+            children = [OWNode(position + row) for row in range(rows)]
+        else:
+            children = [TableNode(position + row) for row in range(rows)]
 
+        self.beginInsertRows(parent, position, position + rows - 1)
+        success = parentNode.insertChildren(position, children)
         self.endInsertRows()
 
+        # The rows after them got renamed
+        self.rowsRenamed(parent, position + rows, childCount + rows - 1)
+
         return success
 
     """INPUTS: int, int, QModelIndex"""
@@ -298,40 +383,84 @@ class TreeViewModel(QtCore.QAbstractItemModel):
         if rows == 0:
             return
 
+        self.fetchAll(parent)
         parentNode = self.getNode(parent)
+
+        # No thumbnails for the removed OWs
+        removed = set()
+        for node in parentNode._children[position:position + rows]:
+            removed.add(node)
+            removed.update(node._children)
+        self.thumbnails.retain(lambda key: key[0] not in removed)
+
         self.beginRemoveRows(parent, position, position + rows - 1)
 
         for row in range(rows):
-            success = parentNode.removeChild(position)
-
             if parentNode.typeInfo() == "table_node":
                 #remove OW
                 root.tables_list[parentNode.getId()].remove_ow(position)
             elif parentNode.typeInfo() == "NODE":
                 root.remove_table(position)
-
-        for row in range(position, parentNode.childCount()):
-            self.setData(self.index(row, 0, parent), row)
+        success = parentNode.removeChildren(position, rows)
 
         self.endRemoveRows()
 
+        self.rowsRenamed(parent, position, parentNode.childCount() - 1)
+
         return success
 
+    def rowsRenamed(self, parent, first, last):
+        # One signal for the names of the rows that moved
+        if first > last:
+            return
+        self.dataChanged.emit(self.index(first, 0, parent), self.index(last, 0, parent),
+                              [QtCore.Qt.DisplayRole])
+
+    def requestThumbnail(self, node):
+        key = node.thumbnailKey()
+        if self.thumbnails.isPending(key):
+            return
+        table_id = node.parent().getId()
+        data, palette, width, height = get_sprite_manager().get_frame_snapshot(node.getId(), table_id, 0)
+
+        # A frame seen before (in this ROM or any other) is shown right away
+        content_key = thumbnail_key(data, palette)
+        cached = thumbnail_cache.get(content_key)
+        if cached is not None:
+            node.thumbnail = indexed_image(*cached)
+            return
+        self.thumbnails.request(key, data, palette, width, height, content_key)
+
+    def thumbnailReady(self, key, image):
+        node, generation = key
+        if generation != node.generation or node.parent() is None:
+            return
+        node.thumbnail = image
+        node.icon = QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+        index = self.createIndex(node.row(), 1, node)
+        self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def cancelHiddenThumbnails(self, view):
+        # Only the rows in the viewport keep their jobs
+        visible = set()
+        height = view.viewport().height()
+        index = view.indexAt(QtCore.QPoint(0, 0))
+        while index.isValid() and view.visualRect(index).top() < height:
+            visible.add(index.internalPointer())
+            index = view.indexBelow(index)
+        self.thumbnails.retain(lambda key: key[0] in visible)
+
     def resetModel(self):
 
-        self._rootNode = Node("root")
+        # Only for a new ROM or Profile, the rest of the changes are incremental
+        self.thumbnails.clear()
         self.beginResetModel()
-
-        self.removeRows(0, self.tablesCount())
+        self._rootNode = Node("root")
 
         for table in range(root.tables_num()):
-            # add the table nodes
+            # add the table nodes, their OWs are fetched when expanded
             newTableNode = TableNode(table, self._rootNode)
 
-            for ow in range(len(root.tables_list[table].ow_data_ptrs)):
-                # add the ow nodes
-                newOWNode = OWNode(ow, newTableNode)
-
         self.endResetModel()
 
     # OW/Table interacting functionsqt
@@ -340,6 +469,7 @@ class TreeViewModel(QtCore.QAbstractItemModel):
 
         parent = self.index(table_id, 0, QtCore.QModelIndex())
         parentNode = self.getNode(parent)
+        self.fetchAll(parent)
 
         for ow in range(rows):
             if ow_id == -1:
@@ -412,35 +542,27 @@ class TreeViewModel(QtCore.QAbstractItemModel):
 
     def owsCount(self, table_id):
         tableNode = self.index(table_id, 0, QtCore.QModelIndex())
+        self.fetchAll(tableNode)
         return self.rowCount(tableNode)
 
     def importOWFrames(self, image_obj, ow_id, table_id, ui):
-        # Check if it needs to repoint the palette table
-        free_slots = ui.sprite_manager.get_free_slots()
-        if free_slots == 0:
-            ui.sprite_manager.repoint_palette_table()
-            ui.rom_info.palette_table_addr = ui.sprite_manager.table_addr
-
         ui.sprite_manager.import_sprites(image_obj, table_id, ow_id)
+        # The palette table is repointed if a new palette didn't fit
+        ui.rom_info.palette_table_addr = ui.sprite_manager.table_addr
 
         tableNode = self.index(table_id, 0, QtCore.QModelIndex())
         owNode = self.index(ow_id, 0, tableNode)
         self.setData(owNode, None)
         ui.item_selected(self.index(ow_id, 0, tableNode))
 
-        # ui.initPaletteIdComboBox()
-        ui.paletteIDComboBox.addItem(capitalized_hex(ui.sprite_manager.used_palettes[-1]))
+        # The palette might be an existing one, so rebuild the list instead of appending
+        ui.initPaletteIdComboBox()
 
         from ui_functions.ui_updater import update_palette_info
         update_palette_info(ui)
 
     def importPokeSpr(self, image_obj, ow_id, table_id, ui):
 
-        free_slots = ui.sprite_manager.get_free_slots()
-        if free_slots == 0:
-            ui.sprite_manager.repoint_palette_table()
-            ui.rom_info.palette_table_addr = ui.sprite_manager.table_addr
-
         ow_type = root.tables_list[ui.selected_table].ow_data_ptrs[ow_id].frames.get_type()
         frames_num = root.tables_list[ui.selected_table].ow_data_ptrs[ow_id].frames.get_num()
 
@@ -449,24 +571,21 @@ class TreeViewModel(QtCore.QAbstractItemModel):
             resetRoot()
 
         ui.sprite_manager.import_pokemon(image_obj, table_id, ow_id)
+        # The palette table is repointed if a new palette didn't fit
+        ui.rom_info.palette_table_addr = ui.sprite_manager.table_addr
 
         tableNode = self.index(table_id, 0, QtCore.QModelIndex())
         owNode = self.index(ow_id, 0, tableNode)
         self.setData(owNode, None)
         ui.item_selected(self.index(ow_id, 0, tableNode))
 
-        ui.paletteIDComboBox.addItem(capitalized_hex(ui.sprite_manager.used_palettes[-1]))
+        ui.initPaletteIdComboBox()
 
         from ui_functions.ui_updater import update_palette_info
         update_palette_info(ui)
 
     def importOWSpr(self, image_obj, ow_id, table_id, ui):
 
-        free_slots = ui.sprite_manager.get_free_slots()
-        if free_slots == 0:
-            ui.sprite_manager.repoint_palette_table()
-            ui.rom_info.palette_table_addr = ui.sprite_manager.table_addr
-
         ow_type = root.tables_list[table_id].ow_data_ptrs[ow_id].frames.get_type()
         frames_num = root.tables_list[table_id].ow_data_ptrs[ow_id].frames.get_num()
 
@@ -475,13 +594,15 @@ class TreeViewModel(QtCore.QAbstractItemModel):
             resetRoot()
 
         ui.sprite_manager.import_ow(image_obj, table_id, ow_id)
+        # The palette table is repointed if a new palette didn't fit
+        ui.rom_info.palette_table_addr = ui.sprite_manager.table_addr
 
         tableNode = self.index(table_id, 0, QtCore.QModelIndex())
         owNode = self.index(ow_id, 0, tableNode)
         self.setData(owNode, None)
         ui.item_selected(self.index(ow_id, 0, tableNode))
 
-        ui.paletteIDComboBox.addItem(capitalized_hex(ui.sprite_manager.used_palettes[-1]))
+        ui.initPaletteIdComboBox()
 
         from ui_functions.ui_updater import update_palette_info
         update_palette_info(ui)
@@ -1,4 +1,5 @@
 from ui_functions.treeViewClasses import *
+from core_files.inspector import inspector
 
 
 def update_ow_menu_buttons(ui):
@@ -36,31 +37,27 @@ def update_ow_text_menu(ui):
 
     if ui.selected_ow is not None and ui.selected_table is not None:
         # OW selected
-        ow_type = root.tables_list[ui.selected_table].ow_data_ptrs[ui.selected_ow].frames.get_type()
-        width, height = get_frame_dimensions(ow_type)
-
-        ui.typeLabel.setText(str(ow_type) + "  [" + str(width) + 'x' + str(height) + ']')
-        ui.framesLabel.setText(str(ui.OWTreeView.selectionModel().currentIndex().internalPointer().frames))
-        ui.ptrAddressLabel.setText(capitalized_hex(
-            root.tables_list[ui.selected_table].ow_data_ptrs[ui.selected_ow].ow_ptr_addr))
-        ui.dataAddressLabel.setText(capitalized_hex(
-            root.tables_list[ui.selected_table].ow_data_ptrs[ui.selected_ow].ow_data_addr))
-        ui.framesPointersLabel.setText(capitalized_hex(
-            root.tables_list[ui.selected_table].ow_data_ptrs[ui.selected_ow].frames.frames_ptrs_addr))
-        ui.framesAddressLabel.setText(capitalized_hex(
-            root.tables_list[ui.selected_table].ow_data_ptrs[ui.selected_ow].frames.frames_addr))
+        ow = inspector.ow(ui.sprite_manager, ui.selected_table, ui.selected_ow)
+
+        ui.typeLabel.setText(str(ow.ow_type) + "  [" + str(ow.width) + 'x' + str(ow.height) + ']')
+        ui.framesLabel.setText(str(ow.frames_num))
+        ui.ptrAddressLabel.setText(capitalized_hex(ow.ow_ptr_addr))
+        ui.dataAddressLabel.setText(capitalized_hex(ow.ow_data_addr))
+        ui.framesPointersLabel.setText(capitalized_hex(ow.frames_ptrs_addr))
+        ui.framesAddressLabel.setText(capitalized_hex(ow.frames_addr))
 
 def update_tables_menu_buttons(ui):
     # They are actually always open
     ui.removeTableButton.setEnabled(False)
+    tables = inspector.tables(ui.sprite_manager)
 
     if ui.selected_table is None:
         ui.removeTableButton.setEnabled(False)
     else:
-        if ui.tree_model.tablesCount() != 1 or root.get_num_of_available_table_ptrs() != 0:
+        if ui.tree_model.tablesCount() != 1 or tables.available_table_ptrs != 0:
             ui.removeTableButton.setEnabled(True)
 
-    if root.get_num_of_available_table_ptrs() != 0:
+    if tables.available_table_ptrs != 0:
         ui.addTableButton.setEnabled(True)
     else:
         ui.addTableButton.setEnabled(False)
@@ -97,26 +94,24 @@ def update_palette_info(ui):
             ui.paletteSlotComboBox.setEnabled(True)
 
             # Sync the TextColor/Footprint ComboBox
-            ow_data_addr = OW(ui.selected_table, ui.selected_ow).ow_data_addr
-            ui.textColorComboBox.setCurrentIndex(get_text_color(ow_data_addr))
-            ui.footprintComboBox.setCurrentIndex(get_footprint(ow_data_addr))
+            ow = inspector.ow(ui.sprite_manager, ui.selected_table, ui.selected_ow)
+            ui.textColorComboBox.setCurrentIndex(ow.text_color)
+            ui.footprintComboBox.setCurrentIndex(ow.footprint)
 
             # Sync the Palette Id ComboBox
-            id_list = [HEX(pal_id) for pal_id in ui.sprite_manager.used_palettes]
-            palette_id = get_ow_palette_id(ow_data_addr)
-
-            index = id_list.index(HEX(palette_id))
+            index = ui.sprite_manager.used_palettes.index(ow.palette_id)
             ui.paletteIDComboBox.setCurrentIndex(index)
 
             # Sync the Palette Slot Combobox
-            ui.paletteSlotComboBox.setCurrentIndex(get_palette_slot(ow_data_addr))
+            ui.paletteSlotComboBox.setCurrentIndex(ow.palette_slot)
 
-            ui.paletteAddressLabel.setText(capitalized_hex(ui.sprite_manager.get_palette_addr(palette_id)))
+            ui.paletteAddressLabel.setText(capitalized_hex(ow.palette_addr))
         else:
             ui.paletteAddressLabel.setText("")
 
-        ui.paletteTableAddressLabel.setText(capitalized_hex(ui.sprite_manager.table_addr))
-        ui.usedPalettesLabel.setText(str(ui.sprite_manager.get_palette_num()))
+        tables = inspector.tables(ui.sprite_manager)
+        ui.paletteTableAddressLabel.setText(capitalized_hex(tables.palette_table_addr))
+        ui.usedPalettesLabel.setText(str(tables.palette_num))
         # ui.availablePalettesLabel.setText(str(ui.sprite_manager.get_free_slots()))
 
 def update_menu_actions(ui):
@@ -125,12 +120,15 @@ def update_menu_actions(ui):
     ui.actionImport_Frames_Sheet.setEnabled(False)
     ui.actionExport_Frames_Sheet.setEnabled(False)
     ui.actionPaletteCleanup.setEnabled(True)
+    ui.actionFind_OW_Duplicates.setEnabled(False)
+    ui.actionFind_Image.setEnabled(True)
 
     if ui.selected_ow is not None:
         ui.menuFrames_Sheet.setEnabled(True)
         ui.menuSpriters_Resource.setEnabled(True)
         ui.actionImport_Frames_Sheet.setEnabled(True)
         ui.actionExport_Frames_Sheet.setEnabled(True)
+        ui.actionFind_OW_Duplicates.setEnabled(True)
 
 def update_viewer(ui):
     if ui.selected_ow is not None: